@@ -0,0 +1,90 @@
+"""Compare encode/decode cost and payload size of the event codecs
+
+Usage: python -m benchmarks.event_codecs
+"""
+
+from events import CODECS, ReprCodec, msgpack
+
+import timeit
+import json
+
+ITERATIONS = 20_000
+
+SCORE_EVENT = (
+    "score",
+    (),
+    {
+        "checksum": "5f4dcc3b5aa765d61d8327deb882cf99",
+        "server": "ppy.sh",
+        "player": json.dumps({
+            "id": 2,
+            "name": "peppy",
+            "country": "AU",
+            "status": {
+                "action": 2,
+                "text": "xi - FREEDOM DiVE [FOUR DIMENSIONS]",
+                "checksum": "da8aae79c8f3306b5d65ec951874a7fb",
+                "mods": 72,
+                "mode": 0,
+                "beatmap_id": 129891
+            },
+            "stats": {
+                "rscore": 123456789012,
+                "tscore": 234567890123,
+                "acc": 0.9912,
+                "pp": 15000,
+                "playcount": 100000,
+                "rank": 1
+            }
+        }),
+        "score": json.dumps({
+            "c300": 1900, "c100": 20, "c50": 0,
+            "cGeki": 300, "cKatu": 10, "cMiss": 1,
+            "total_score": 123456789, "total_hits": 1921,
+            "max_combo": 2300, "perfect": False, "mods": 72,
+            "accuracy": 99.3, "grade": "A", "passed": True, "length": 258,
+            "filename": "peppy - xi - FREEDOM DiVE [FOUR DIMENSIONS] (2024-01-01 00-00-00) Osu.osr",
+            "filename_safe": "replay-osu_5f4dcc3b5aa765d61d8327deb882cf99.osr"
+        })
+    }
+)
+
+STATS_UPDATE_EVENT = (
+    "stats_update",
+    (list(range(1_000, 1_500)), "ppy.sh"),
+    {}
+)
+
+def measure(codec, event) -> dict:
+    data = codec.encode(*event)
+    payload = data[1:] if not isinstance(codec, ReprCodec) else data
+
+    encode = timeit.timeit(lambda: codec.encode(*event), number=ITERATIONS)
+    decode = timeit.timeit(lambda: codec.load(payload), number=ITERATIONS)
+
+    return {
+        "size": len(data),
+        "encode_us": encode / ITERATIONS * 1e6,
+        "decode_us": decode / ITERATIONS * 1e6
+    }
+
+def main() -> None:
+    names = [name for name in CODECS if name != "msgpack" or msgpack]
+
+    for event in (SCORE_EVENT, STATS_UPDATE_EVENT):
+        print(f'Event "{event[0]}":')
+
+        for name in names:
+            result = measure(CODECS[name](), event)
+            print(
+                f"  {name:<8} {result['size']:>6} bytes  "
+                f"encode {result['encode_us']:>7.2f} us  "
+                f"decode {result['decode_us']:>7.2f} us"
+            )
+
+        legacy = str(event).encode()
+        decode = timeit.timeit(lambda: eval(legacy), number=ITERATIONS)
+        print(f"  {'eval':<8} {len(legacy):>6} bytes  decode {decode / ITERATIONS * 1e6:>7.2f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Benchmark frame ingestion and replay finalization
+
+Usage:
+    python -m benchmarks.replay_pipeline --minutes 1 5 15 --save baseline.json
+    python -m benchmarks.replay_pipeline --compare baseline.json
+"""
+
+from typing import Dict, List, Optional
+from osu.objects import Player
+
+from fakes import FakeGame, SnapshotCollector, setup
+from benchmarks.synthetic import generate_play, Packet
+from replays import ReplayManager
+
+import subprocess
+import statistics
+import tracemalloc
+import argparse
+import json
+import time
+
+def create_manager(hp_graph: tuple) -> ReplayManager:
+    game = FakeGame()
+
+    player = Player(2, "peppy", game)
+    player.rank = 1
+    player.status.checksum = "da8aae79c8f3306b5d65ec951874a7fb"
+    player.status.text = "xi - FREEDOM DiVE [FOUR DIMENSIONS]"
+    game.bancho.spectating = player
+
+    manager = ReplayManager(game, SnapshotCollector(), hp_graph)
+    manager.current_status = player.status
+    return manager
+
+def run(packets: List[Packet], hp_graph: tuple) -> Dict[str, float]:
+    """Feed a play into a replay manager, and time every step"""
+    manager = create_manager(hp_graph)
+    frames = sum(len(packet[1]) for packet in packets)
+
+    start = time.perf_counter()
+
+    for action, replay_frames, score_frame, extra in packets[:-1]:
+        manager.handle_frames(replay_frames, action, extra, score_frame)
+
+    ingest = time.perf_counter() - start
+
+    # Completion packet, which creates the snapshot on the packet thread
+    action, replay_frames, score_frame, extra = packets[-1]
+    start = time.perf_counter()
+    manager.handle_frames(replay_frames, action, extra, score_frame)
+    snapshot_time = time.perf_counter() - start
+
+    snapshot = manager.finalizer.snapshots[0]
+
+    start = time.perf_counter()
+    replay_file = snapshot.create_osr()
+    create_osr = time.perf_counter() - start
+
+    start = time.perf_counter()
+    snapshot.score.submit(replay_file)
+    submit = time.perf_counter() - start
+
+    return {
+        "frames": frames,
+        "frames_per_second": frames / ingest,
+        "ingest": ingest,
+        "snapshot": snapshot_time,
+        "create_osr": create_osr,
+        "submit": submit,
+        "finalize": snapshot_time + create_osr + submit,
+        "replay_size": len(replay_file)
+    }
+
+def peak_memory(packets: List[Packet], hp_graph: tuple) -> int:
+    tracemalloc.start()
+
+    try:
+        run(packets, hp_graph)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchmark(minutes: float, score_rate: int, runs: int, hp_graph: tuple) -> Dict[str, float]:
+    packets = generate_play(minutes, score_rate=score_rate)
+    results = [run(packets, hp_graph) for _ in range(runs)]
+    snapshot = [result["snapshot"] for result in results]
+    finalize = [result["finalize"] for result in results]
+
+    return {
+        "frames": results[0]["frames"],
+        "frames_per_second": statistics.median(r["frames_per_second"] for r in results),
+        "create_osr": statistics.median(r["create_osr"] for r in results),
+        "submit": statistics.median(r["submit"] for r in results),
+        # Too few runs for tail percentiles, so the spread is reported instead
+        "snapshot_min": min(snapshot),
+        "snapshot_p50": statistics.median(snapshot),
+        "snapshot_max": max(snapshot),
+        "finalize_min": min(finalize),
+        "finalize_p50": statistics.median(finalize),
+        "finalize_max": max(finalize),
+        "replay_size": results[0]["replay_size"],
+        "peak_memory": peak_memory(packets, hp_graph)
+    }
+
+def commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: dict, baseline: dict) -> None:
+    print(f"Comparing against {baseline.get('commit') or 'baseline'}:")
+
+    for name, scenario in results["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            continue
+
+        print(f"  {name}:")
+
+        for metric, value in scenario.items():
+            previous = baseline["scenarios"][name].get(metric)
+
+            if not previous:
+                continue
+
+            change = (value - previous) / previous * 100
+            print(f"    {metric:<18} {previous:>14.6g} -> {value:>14.6g} ({change:+.1f}%)")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="replay pipeline benchmark")
+    parser.add_argument('--minutes', nargs='+', type=float, default=[1, 5, 15])
+    parser.add_argument('--score-rate', type=int, default=45, help='Score frames per second')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--hp-graph', default='full', choices=['full', 'interval', 'lttb'])
+    parser.add_argument('--hp-graph-resolution', type=int, default=0)
+    parser.add_argument('--save', help='Write results to this json file')
+    parser.add_argument('--compare', help='Compare results against this json file')
+    args = parser.parse_args()
+
+    setup()
+    hp_graph = (args.hp_graph, args.hp_graph_resolution)
+
+    results = {
+        "commit": commit(),
+        "score_rate": args.score_rate,
+        "hp_graph": list(hp_graph),
+        "scenarios": {}
+    }
+
+    for minutes in args.minutes:
+        name = f"{minutes:g}min"
+        scenario = benchmark(minutes, args.score_rate, args.runs, hp_graph)
+        results["scenarios"][name] = scenario
+
+        print(
+            f"{name}: {scenario['frames']} frames, "
+            f"{scenario['frames_per_second']:,.0f} frames/s ingested, "
+            f"snapshot min/p50/max {scenario['snapshot_min'] * 1000:.2f} / "
+            f"{scenario['snapshot_p50'] * 1000:.2f} / {scenario['snapshot_max'] * 1000:.2f} ms, "
+            f"finalize min/p50/max {scenario['finalize_min'] * 1000:.1f} / "
+            f"{scenario['finalize_p50'] * 1000:.1f} / {scenario['finalize_max'] * 1000:.1f} ms, "
+            f"peak memory {scenario['peak_memory'] / 1024 ** 2:.1f} MiB"
+        )
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
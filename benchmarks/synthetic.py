@@ -0,0 +1,122 @@
+"""Synthetic spectator packets, that resemble a real play"""
+
+from typing import Iterator, List, Optional, Tuple
+from osu.objects import ReplayFrame, ScoreFrame
+from osu.bancho.constants import ButtonState, ReplayAction
+
+import random
+import struct
+import math
+
+Packet = Tuple[ReplayAction, List[ReplayFrame], Optional[ScoreFrame], int]
+
+def float32(value: float) -> float:
+    """Round a value the same way, as frames that were read from bancho"""
+    return struct.unpack("<f", struct.pack("<f", value))[0]
+
+def cursor_path(
+    minutes: float,
+    frame_rate: int,
+    object_interval: int,
+    rng: random.Random
+) -> Iterator[Tuple[ReplayFrame, bool]]:
+    """Cursor movement between randomly placed hit objects
+
+    Yields every frame, and whether a hit object was clicked on it.
+    """
+    length = int(minutes * 60_000)
+    frame_time = 1000 / frame_rate
+
+    start_x, start_y = 256.0, 192.0
+    target_x, target_y = rng.uniform(32, 480), rng.uniform(32, 352)
+    object_time = object_interval
+    previous_object = 0
+    key = ButtonState.Left1
+    time = 0.0
+
+    while time < length:
+        time += frame_time + rng.uniform(-1.5, 1.5)
+
+        if time >= object_time:
+            # Move on to the next hit object
+            start_x, start_y = target_x, target_y
+            target_x = min(512.0, max(0.0, start_x + rng.gauss(0, 120)))
+            target_y = min(384.0, max(0.0, start_y + rng.gauss(0, 90)))
+            previous_object = object_time
+            object_time += object_interval * rng.choice((0.5, 1, 1, 1, 2))
+            key = ButtonState.Right1 if key == ButtonState.Left1 else ButtonState.Left1
+
+        # Ease towards the target, with some hand jitter
+        progress = (time - previous_object) / (object_time - previous_object)
+        eased = (1 - math.cos(min(1.0, progress * 1.3) * math.pi)) / 2
+        x = start_x + (target_x - start_x) * eased + rng.gauss(0, 0.8)
+        y = start_y + (target_y - start_y) * eased + rng.gauss(0, 0.8)
+
+        pressed = time - previous_object < 60
+        frame = ReplayFrame(
+            key if pressed else ButtonState.NoButtons,
+            int(time),
+            float32(x),
+            float32(y)
+        )
+        yield frame, pressed and time - previous_object < frame_time
+
+def generate_play(
+    minutes: float = 5,
+    frame_rate: int = 60,
+    score_rate: int = 45,
+    object_interval: int = 300,
+    seed: int = 0
+) -> List[Packet]:
+    """Spectator packets of a full play, ending with a completion"""
+    rng = random.Random(seed)
+    packets: List[Packet] = []
+
+    hits = [0, 0, 0, 0]  # 300, 100, 50, miss
+    combo = max_combo = score = 0
+    hp = 200.0
+
+    frames: List[ReplayFrame] = []
+    next_score_frame = 1000 / score_rate
+
+    for frame, hit in cursor_path(minutes, frame_rate, object_interval, rng):
+        frames.append(frame)
+
+        if hit:
+            judgement = rng.choices(range(4), weights=(90, 7, 1, 2))[0]
+            hits[judgement] += 1
+            combo = 0 if judgement == 3 else combo + 1
+            max_combo = max(max_combo, combo)
+            score += (300, 100, 50, 0)[judgement] * max(1, combo)
+            hp = min(200.0, hp + 6) if judgement < 3 else max(0.0, hp - 25)
+
+        if frame.time < next_score_frame:
+            continue
+
+        next_score_frame += 1000 / score_rate
+        hp = max(0.0, hp - 0.4)
+
+        score_frame = ScoreFrame(
+            frame.time, 0,
+            hits[0], hits[1], hits[2], 0, 0, hits[3],
+            score, max_combo, combo,
+            hits[3] == 0, int(hp), 0
+        )
+        packets.append((ReplayAction.Standard, frames, score_frame, seed))
+        frames = []
+
+    packets.append((ReplayAction.Completion, frames, None, seed))
+    return packets
+
+def replay_string(packets: List[Packet], seed: int = 0) -> str:
+    """Uncompressed frame stream of a replay, that received these packets"""
+    entries = []
+    previous = 0
+
+    for _, frames, _, _ in packets:
+        for frame in frames:
+            entries.append(f"{frame.time - previous}|{frame.x}|{frame.y}|{frame.button_state.value}")
+            previous = frame.time
+
+    entries.append(f"-12345|0|0|{seed}")
+    return ",".join(entries)
@@ -0,0 +1,281 @@
+"""Record spectator packets to disk, and play them back into a replay manager
+
+Usage:
+    python capture.py captures/*.cap --speed 0 --output regenerated/
+    python capture.py captures/*.cap --speed 4 --compare regenerated/
+"""
+
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from threading import Lock
+from copy import copy
+
+from osu.bancho.constants import ReplayAction, StatusAction, Mods, Mode
+from osu.objects import ReplayFrame, ScoreFrame, Player, Status
+from osu.bancho.streams import StreamIn, StreamOut
+
+import argparse
+import logging
+import struct
+import time
+import os
+
+MAGIC = b"SPEC"
+VERSION = 2
+
+# Settings of captures, that were recorded before they were stored in the header
+LEGACY_CLIENT_VERSION = 20240101
+LEGACY_HP_GRAPH = ("full", 0)
+
+RECORD_FRAMES = 0
+RECORD_PLAYER = 1
+
+FramesRecord = Tuple[float, ReplayAction, List[ReplayFrame], Optional[ScoreFrame], int]
+PlayerRecord = Tuple[float, int, str, Status]
+
+# Client version & hp graph settings of the slot, that recorded a capture
+Header = Tuple[int, Tuple[str, int]]
+
+class PacketRecorder:
+    """Appends spectator packets of a single slot to a capture file
+
+    The file starts with the client version and hp graph settings of the slot,
+    so that replays can be recreated the same way. Every record is prefixed
+    with its length, followed by the record type and the time it was received.
+    Whenever the spectated player or their status changes, a player record
+    gets written before the next packet.
+    """
+
+    def __init__(self, path: str, version: int, hp_graph: Tuple[str, int] = ("full", 0)) -> None:
+        self.path = path
+        self.lock = Lock()
+        self.last_player: Optional[tuple] = None
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "ab")
+
+        if self.file.tell() == 0:
+            header = StreamOut()
+            header.s32(round(version))
+            header.string(hp_graph[0])
+            header.s32(hp_graph[1])
+
+            self.file.write(MAGIC + bytes([VERSION]))
+            self.file.write(struct.pack("<I", len(header.get())) + header.get())
+
+    def write(self, record_type: int, data: bytes) -> None:
+        self.file.write(struct.pack("<IBd", len(data), record_type, time.time()))
+        self.file.write(data)
+
+    def record(
+        self,
+        player: Player,
+        action: ReplayAction,
+        frames: List[ReplayFrame],
+        score_frame: Optional[ScoreFrame],
+        extra: int
+    ) -> None:
+        with self.lock:
+            status = player.status
+            current = (
+                player.id, player.name, status.action, status.text,
+                status.checksum, status.mods, status.mode, status.beatmap_id
+            )
+
+            if current != self.last_player:
+                stream = StreamOut()
+                stream.s32(player.id)
+                stream.string(player.name)
+                stream.u8(status.action.value)
+                stream.string(status.text)
+                stream.string(status.checksum)
+                stream.u32(status.mods.value)
+                stream.u8(status.mode.value)
+                stream.s32(status.beatmap_id)
+                self.write(RECORD_PLAYER, stream.get())
+                self.last_player = current
+
+            stream = StreamOut()
+            stream.u8(action.value)
+            stream.s32(extra)
+            stream.u16(len(frames))
+
+            for frame in frames:
+                stream.write(frame.encode())
+
+            stream.bool(score_frame is not None)
+
+            if score_frame:
+                stream.write(score_frame.encode())
+
+            self.write(RECORD_FRAMES, stream.get())
+
+    def flush(self) -> None:
+        with self.lock:
+            self.file.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+def read_header(file: BinaryIO) -> Header:
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a capture file")
+
+    version = file.read(1)[0]
+
+    if version == 1:
+        return LEGACY_CLIENT_VERSION, LEGACY_HP_GRAPH
+
+    if version != VERSION:
+        raise ValueError(f"Unsupported capture version: {version}")
+
+    length, = struct.unpack("<I", file.read(4))
+    stream = StreamIn(file.read(length))
+    client_version = stream.s32()
+    hp_graph = (stream.string(), stream.s32())
+    return client_version, hp_graph
+
+def read_records(file: BinaryIO) -> Iterator[Union[FramesRecord, PlayerRecord]]:
+    """Read every record, after the header was read"""
+    while len(header := file.read(13)) == 13:
+        length, record_type, timestamp = struct.unpack("<IBd", header)
+        data = file.read(length)
+
+        if len(data) < length:
+            # Capture was cut off while writing
+            break
+
+        stream = StreamIn(data)
+
+        if record_type == RECORD_PLAYER:
+            player_id = stream.s32()
+            name = stream.string()
+            status = Status()
+            status.action = StatusAction(stream.u8())
+            status.text = stream.string()
+            status.checksum = stream.string()
+            status.mods = Mods(stream.u32())
+            status.mode = Mode(stream.u8())
+            status.beatmap_id = stream.s32()
+            yield timestamp, player_id, name, status
+            continue
+
+        action = ReplayAction(stream.u8())
+        extra = stream.s32()
+        frames = [ReplayFrame.decode(stream) for _ in range(stream.u16())]
+        score_frame = ScoreFrame.decode(stream) if stream.bool() else None
+        yield timestamp, action, frames, score_frame, extra
+
+def play(path: str, speed: float = 0) -> List[Tuple[str, bytes]]:
+    """Feed a capture file into a replay manager
+
+    `speed` is the playback speed relative to real time,
+    where `0` plays everything back as fast as possible.
+
+    Returns the filename and contents of every replay that was created.
+    """
+    from fakes import FakeGame, SnapshotCollector, setup
+    from replays import ReplayManager
+
+    with open(path, "rb") as f:
+        version, hp_graph = read_header(f)
+
+    setup()
+    game = FakeGame(version=version)
+    collector = SnapshotCollector()
+    manager = ReplayManager(game, collector, hp_graph)
+    replays = []
+
+    # Replays are timestamped with the time of the packet, that finished them
+    packet_time = 0.0
+    manager.clock = lambda: datetime.fromtimestamp(packet_time, timezone.utc)
+
+    started = time.perf_counter()
+    first_timestamp = None
+
+    with open(path, "rb") as f:
+        read_header(f)
+
+        for record in read_records(f):
+            timestamp = record[0]
+            first_timestamp = first_timestamp or timestamp
+
+            if speed > 0:
+                delay = (timestamp - first_timestamp) / speed - (time.perf_counter() - started)
+
+                if delay > 0:
+                    time.sleep(delay)
+
+            if len(record) == 4:
+                _, player_id, name, status = record
+                player = Player(player_id, name, game)
+                player.status = status
+                game.bancho.spectating = player
+
+                if status.action in (StatusAction.Playing, StatusAction.Multiplaying):
+                    # Same as the stats update handler
+                    manager.current_status = copy(status)
+
+                continue
+
+            _, action, frames, score_frame, extra = record
+            packet_time = timestamp
+            manager.handle_frames(frames, action, extra, score_frame)
+
+            while collector.snapshots:
+                snapshot = collector.snapshots.pop(0)
+                replays.append((snapshot.score.filename_safe, snapshot.create_osr()))
+
+    return replays
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="spectator capture playback")
+    parser.add_argument('files', nargs='+', help='Capture files to play back')
+    parser.add_argument('--speed', type=float, default=0, help='Playback speed (0 = as fast as possible)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Captures to play back in parallel')
+    parser.add_argument('--output', help='Write regenerated replays into this directory')
+    parser.add_argument('--compare', help='Compare regenerated replays against this directory')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    started = time.perf_counter()
+    mismatches = 0
+    total = 0
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = executor.map(play, args.files, [args.speed] * len(args.files))
+
+        for path, replays in zip(args.files, results):
+            print(f"{path}: {len(replays)} replay(s)")
+            total += len(replays)
+
+            for filename, replay_file in replays:
+                if args.output:
+                    os.makedirs(args.output, exist_ok=True)
+
+                    with open(os.path.join(args.output, filename), "wb") as f:
+                        f.write(replay_file)
+
+                if not args.compare:
+                    continue
+
+                try:
+                    with open(os.path.join(args.compare, filename), "rb") as f:
+                        expected = f.read()
+                except FileNotFoundError:
+                    expected = None
+
+                if expected != replay_file:
+                    print(f"  {filename} does not match")
+                    mismatches += 1
+
+    print(f"Created {total} replay(s) in {time.perf_counter() - started:.2f}s")
+
+    if args.compare:
+        print(f"{total - mismatches}/{total} replay(s) match")
+        exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+from typing import TYPE_CHECKING, Optional
+from osu.bancho.constants import StatusAction, Mods, Mode
+from osu.objects import Status
+from redis import Redis
+
+if TYPE_CHECKING:
+    from slots import Slot
+
+import json
+
+def encode_status(status: Status) -> dict:
+    return {
+        "action": status.action.value,
+        "text": status.text,
+        "checksum": status.checksum,
+        "mods": status.mods.value,
+        "mode": status.mode.value,
+        "beatmap_id": status.beatmap_id
+    }
+
+def decode_status(data: dict) -> Status:
+    status = Status()
+    status.action = StatusAction(data["action"])
+    status.text = data["text"]
+    status.checksum = data["checksum"]
+    status.mods = Mods(data["mods"])
+    status.mode = Mode(data["mode"])
+    status.beatmap_id = data["beatmap_id"]
+    return status
+
+class Checkpoints:
+    """Spectating state of every slot, so that a restarted worker can resume it
+
+    Checkpoints are keyed by the lease owner of a slot, which stays
+    the same across restarts, and expire after `ttl` seconds.
+    """
+
+    def __init__(self, connection: Redis, ttl: int = 60 * 10) -> None:
+        self.redis = connection
+        self.ttl = ttl
+
+    def key(self, slot: "Slot") -> str:
+        return f"checkpoints:{slot.server}:{slot.owner}"
+
+    def encode(self, slot: "Slot") -> str:
+        target = slot.spectating
+
+        return json.dumps({
+            "started": slot.started,
+            "target": {
+                "id": target.id,
+                "name": target.name
+            } if target else None,
+            "status": encode_status(slot.manager.current_status)
+        })
+
+    def save(self, key: str, data: str) -> None:
+        self.redis.set(key, data, ex=self.ttl)
+
+    def delete(self, key: str) -> None:
+        self.redis.delete(key)
+
+    def load(self, slot: "Slot") -> Optional[dict]:
+        if not (data := self.redis.get(self.key(slot))):
+            return None
+
+        checkpoint = json.loads(data)
+        checkpoint["status"] = decode_status(checkpoint["status"])
+        return checkpoint
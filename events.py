@@ -1,18 +1,125 @@
-
-from typing import Dict, Generator, Callable
-from redis import Redis
+from typing import Dict, Generator, Callable, List, Optional, Tuple
+from threading import Event as ThreadEvent, Thread
+from redis import Redis, ResponseError
 
 import logging
+import socket
+import json
+import time
+import ast
+import os
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+Event = Tuple[str, tuple, dict]
+Message = Tuple[Optional[bytes], Event]
+
+class Codec:
+    """Serializes events, prefixed with a version byte"""
+    version: int = 0
+
+    def encode(self, event: str, args: tuple, kwargs: dict) -> bytes:
+        return bytes([self.version]) + self.dump(event, args, kwargs)
+
+    def dump(self, event: str, args: tuple, kwargs: dict) -> bytes:
+        raise NotImplementedError
+
+    def load(self, data: bytes) -> Event:
+        raise NotImplementedError
+
+class JsonCodec(Codec):
+    version = 1
+
+    def dump(self, event: str, args: tuple, kwargs: dict) -> bytes:
+        return json.dumps(
+            [event, args, kwargs],
+            separators=(",", ":")
+        ).encode()
+
+    def load(self, data: bytes) -> Event:
+        event, args, kwargs = json.loads(data)
+        return event, tuple(args), kwargs
+
+class MsgpackCodec(Codec):
+    version = 2
+
+    def __init__(self) -> None:
+        if not msgpack:
+            raise RuntimeError("msgpack is not installed")
+
+    def dump(self, event: str, args: tuple, kwargs: dict) -> bytes:
+        return msgpack.packb([event, args, kwargs])
+
+    def load(self, data: bytes) -> Event:
+        event, args, kwargs = msgpack.unpackb(data)
+        return event, tuple(args), kwargs
+
+class ReprCodec(Codec):
+    """Legacy format, which is a python tuple literal"""
+
+    def encode(self, event: str, args: tuple, kwargs: dict) -> bytes:
+        return str((event, args, kwargs)).encode()
+
+    def load(self, data: bytes) -> Event:
+        return ast.literal_eval(data.decode())
+
+CODECS = {
+    "json": JsonCodec,
+    "msgpack": MsgpackCodec,
+    "repr": ReprCodec
+}
 
 class EventQueue:
-    def __init__(self, name: str, connection: Redis) -> None:
+    """Events, sent over a redis pubsub channel or a redis stream
+
+    Streams keep events until they are acknowledged by a consumer group,
+    so that nothing gets lost while no consumer is running.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        connection: Redis,
+        codec: Optional[Codec] = None,
+        legacy: bool = True,
+        transport: str = "pubsub",
+        maxlen: int = 100_000,
+        group: Optional[str] = None,
+        consumer: Optional[str] = None,
+        reclaim_after: float = 60
+    ) -> None:
         self.redis = connection
         self.name = name
 
+        self.transport = transport
+        self.stream = f"{name}:events"
+        self.maxlen = maxlen
+        self.group = group or f"{name}-consumers"
+        self.consumer = consumer or f"{socket.gethostname()}:{os.getpid()}"
+        self.reclaim_after = reclaim_after
+
+        # Consumers that still evaluate the legacy format would break on any other
+        self.codec = codec or ReprCodec()
+        self.legacy = legacy
+        self.decoders: Dict[int, Codec] = {
+            JsonCodec.version: JsonCodec()
+        }
+
+        if msgpack:
+            self.decoders[MsgpackCodec.version] = MsgpackCodec()
+
         self.events: Dict[str, Callable] = {}
         self.logger = logging.getLogger(self.name)
 
         self.channel = self.redis.pubsub()
+        self.thread: Optional[Thread] = None
+        self.stopped = ThreadEvent()
+
+        self.dispatched = 0
+        self.backlog = 0
 
     def register(self, event_name: str):
         """Register an event"""
@@ -24,20 +131,118 @@ class EventQueue:
             return callback
         return wrapper
 
+    def encode(self, event: str, *args, **kwargs) -> bytes:
+        return self.codec.encode(event, args, kwargs)
+
+    def decode(self, data: bytes) -> Event:
+        """Decode an event, based on its version byte"""
+        if isinstance(data, str):
+            data = data.encode()
+
+        if data[:1] == b"(":
+            # Legacy events start with the opening bracket of the tuple
+            if not self.legacy:
+                raise ValueError("Legacy events are not accepted")
+
+            return ReprCodec().load(data)
+
+        if not (codec := self.decoders.get(data[0])):
+            raise ValueError(f"Unknown codec version: {data[0]}")
+
+        return codec.load(data[1:])
+
     def submit(self, event: str, *args, **kwargs):
         """Push an event to the queue"""
-        self.redis.publish(self.name, str((event, args, kwargs)))
+        data = self.encode(event, *args, **kwargs)
+
+        if self.transport == "stream":
+            self.redis.xadd(
+                self.stream,
+                {"data": data},
+                maxlen=self.maxlen,
+                approximate=True
+            )
+            self.logger.debug(f'Submitted event "{event}" to stream')
+            return
+
+        self.redis.publish(self.name, data)
         self.logger.debug(f'Submitted event "{event}" to pubsub channel')
 
+    def create_group(self) -> None:
+        """Create the consumer group of the stream, if it does not exist yet"""
+        try:
+            self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def ack(self, message_ids: List[bytes]) -> None:
+        if message_ids:
+            self.redis.xack(self.stream, self.group, *message_ids)
+
+    def read(self, entries: list) -> List[Message]:
+        """Decode stream entries, acknowledging the ones that cannot be read"""
+        messages = []
+        invalid = []
+
+        for message_id, fields in entries:
+            if not fields:
+                # Entry was trimmed from the stream
+                invalid.append(message_id)
+                continue
+
+            try:
+                messages.append((message_id, self.decode(fields[b"data"])))
+            except Exception as e:
+                self.logger.warning(f'Failed to decode event: {e}')
+                invalid.append(message_id)
+
+        self.ack(invalid)
+        return messages
+
+    def read_group(self, message_id: str, timeout: float, limit: int) -> List[Message]:
+        response = self.redis.xreadgroup(
+            self.group,
+            self.consumer,
+            {self.stream: message_id},
+            count=limit,
+            block=int(timeout * 1000) if message_id == ">" else None
+        )
+
+        if not response:
+            return []
+
+        return self.read(response[0][1])
+
+    def reclaim(self, limit: int = 1000) -> List[Message]:
+        """Take over events, that other consumers did not acknowledge in time"""
+        response = self.redis.xautoclaim(
+            self.stream,
+            self.group,
+            self.consumer,
+            min_idle_time=int(self.reclaim_after * 1000),
+            start_id="0-0",
+            count=limit
+        )
+
+        if messages := self.read(response[1]):
+            self.logger.info(f'Reclaimed {len(messages)} pending event(s)')
+
+        return messages
+
     def listen(self) -> Generator:
         """Listen for events from the queue"""
+        if self.transport == "stream":
+            yield from self.listen_stream()
+            return
+
         self.channel.subscribe(self.name)
         self.logger.info('Listening to pubsub channel...')
 
         for message in self.channel.listen():
             try:
                 if message['data'] == 1: continue
-                name, args, kwargs = eval(message['data'])
+                name, args, kwargs = self.decode(message['data'])
                 self.logger.debug(
                     f'Got event for "{name}" with {args} and {kwargs}'
                 )
@@ -50,3 +255,142 @@ class EventQueue:
                 self.logger.warning(
                     f'Failed to evaluate task: {e}'
                 )
+
+    def listen_stream(self) -> Generator:
+        """Listen for events from the stream
+
+        Events are acknowledged, once the next event is requested.
+        """
+        self.create_group()
+        self.logger.info('Listening to stream...')
+
+        # Continue with events, that were not acknowledged before a restart
+        messages = self.read_group("0", 0, 1000)
+
+        while True:
+            messages = messages or self.reclaim() or self.read_group(">", 5, 100)
+
+            while messages:
+                message_id, (name, args, kwargs) = messages.pop(0)
+
+                if name in self.events:
+                    yield self.events[name], args, kwargs
+                else:
+                    self.logger.warning(f'No callback found for "{name}"')
+
+                self.ack([message_id])
+
+    def drain(self, timeout: float = 1.0, limit: int = 1000) -> List[Message]:
+        """Wait for the next message, and return every event that is pending"""
+        if self.transport == "stream":
+            return self.read_group(">", timeout, limit)
+
+        events = []
+        message = self.channel.get_message(timeout=timeout)
+
+        while message:
+            if message['type'] == 'message':
+                try:
+                    events.append((None, self.decode(message['data'])))
+                except Exception as e:
+                    self.logger.warning(f'Failed to decode event: {e}')
+
+            if len(events) >= limit:
+                # The next message is left for the following drain
+                break
+
+            message = self.channel.get_message(timeout=0)
+
+        return events
+
+    def dispatch(self, name: str, args: tuple, kwargs: dict) -> bool:
+        """Run the callback of an event, returns `False` if it raised an exception"""
+        if not (callback := self.events.get(name)):
+            # Retrying would not help with these
+            self.logger.warning(f'No callback found for "{name}"')
+            return True
+
+        self.logger.debug(
+            f'Got event for "{name}" with {args} and {kwargs}'
+        )
+
+        try:
+            callback(*args, **kwargs)
+        except Exception as e:
+            self.logger.error(f'Failed to run "{name}": {e}', exc_info=e)
+            return False
+
+        return True
+
+    def consume(self, report_interval: float = 60) -> None:
+        """Dispatch every pending event, until the queue gets stopped"""
+        if self.transport == "stream":
+            self.create_group()
+            self.logger.info('Listening to stream...')
+            pending = self.read_group("0", 0, 1000)
+        else:
+            self.channel.subscribe(self.name)
+            self.logger.info('Listening to pubsub channel...')
+            pending = []
+
+        last_report = last_reclaim = time.time()
+        dispatched = 0
+        backlog = 0
+
+        while not self.stopped.is_set():
+            try:
+                messages = pending or self.drain()
+                pending = []
+
+                if self.transport == "stream" and time.time() - last_reclaim > self.reclaim_after:
+                    messages += self.reclaim()
+                    last_reclaim = time.time()
+            except Exception as e:
+                self.logger.error(f'Failed to receive events: {e}')
+                self.stopped.wait(1)
+                continue
+
+            # Failed events stay pending, until they are reclaimed
+            dispatched_ids = [
+                message_id for message_id, event in messages
+                if self.dispatch(*event)
+            ]
+
+            if self.transport == "stream":
+                try:
+                    self.ack(dispatched_ids)
+                except Exception as e:
+                    self.logger.error(f'Failed to acknowledge events: {e}')
+
+            self.backlog = len(messages)
+            self.dispatched += len(messages)
+            backlog = max(backlog, len(messages))
+
+            if (elapsed := time.time() - last_report) < report_interval:
+                continue
+
+            self.logger.info(
+                f'Dispatched {(self.dispatched - dispatched) / elapsed:.2f} events/s '
+                f'(largest backlog: {backlog})'
+            )
+            last_report = time.time()
+            dispatched = self.dispatched
+            backlog = 0
+
+        if self.transport == "pubsub":
+            self.channel.unsubscribe(self.name)
+
+    def start(self) -> None:
+        """Consume events in a background thread"""
+        self.thread = Thread(
+            target=self.consume,
+            name=f"{self.name}-consumer",
+            daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+        if self.thread:
+            self.thread.join()
@@ -0,0 +1,94 @@
+from typing import Callable, Optional
+from concurrent.futures import Future
+from threading import Thread
+from redis import Redis
+
+import logging
+import metrics
+import queue
+import time
+
+pending = metrics.registry.gauge(
+    "spectator_redis_executor_pending",
+    "Redis calls waiting inside the executor queue"
+)
+dropped = metrics.registry.counter(
+    "spectator_redis_executor_dropped_total",
+    "Redis calls dropped, because the executor queue was full"
+)
+wait_seconds = metrics.registry.histogram(
+    "spectator_redis_executor_wait_seconds",
+    "Time redis calls spent waiting inside the executor queue"
+)
+
+class ExecutorFull(Exception):
+    pass
+
+class RedisExecutor:
+    """Runs redis calls on a background thread, so packet handlers never wait on redis
+
+    Calls are executed in the order they were submitted. Every call returns
+    a future, which only needs to be awaited by callers that need the result.
+    The queue is bounded: once it is full, new calls are dropped and fail.
+    """
+
+    def __init__(self, connection: Redis, size: int = 10_000) -> None:
+        self.redis = connection
+        self.queue: queue.Queue = queue.Queue(maxsize=size)
+        self.logger = logging.getLogger("redis-executor")
+
+        self.thread = Thread(target=self.worker, name="redis-executor", daemon=True)
+        pending.callback = lambda: {(): self.queue.qsize()}
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def submit(self, function: Callable, *args, **kwargs) -> Future:
+        """Queue a call to `function`, without blocking"""
+        future = Future()
+
+        try:
+            self.queue.put_nowait((future, time.perf_counter(), function, args, kwargs))
+        except queue.Full:
+            dropped.inc()
+            self.logger.warning(f'Executor queue is full, dropping call to "{function.__name__}"')
+            future.set_exception(ExecutorFull())
+
+        return future
+
+    def execute(self, command: str, *args, **kwargs) -> Future:
+        """Queue a redis command, e.g. `execute("delete", key)`"""
+        return self.submit(getattr(self.redis, command), *args, **kwargs)
+
+    def ping(self, timeout: float = 5) -> bool:
+        """Check that both the executor thread and redis respond in time"""
+        try:
+            return bool(self.execute("ping").result(timeout))
+        except Exception as e:
+            self.logger.error(f"Redis executor is unhealthy: {e}")
+            return False
+
+    def worker(self) -> None:
+        while True:
+            call: Optional[tuple] = self.queue.get()
+
+            if call is None:
+                break
+
+            future, submitted, function, args, kwargs = call
+            wait_seconds.observe(time.perf_counter() - submitted)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception as e:
+                self.logger.error(f'Failed to run "{function.__name__}": {e}')
+                future.set_exception(e)
+
+    def shutdown(self) -> None:
+        """Wait for every queued call to finish"""
+        self.logger.info(f"Waiting for {self.queue.qsize()} redis call(s)...")
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,156 @@
+"""In-process stand-ins for redis and the osu! client
+
+Used to play back captures, and by the benchmarks.
+"""
+
+from typing import TYPE_CHECKING, Dict, List, Optional
+from osu.objects import Player
+
+from storage import RedisStorage
+from events import EventQueue
+
+if TYPE_CHECKING:
+    from replays import ReplaySnapshot
+
+import logging
+import session
+import time
+
+class FakePubSub:
+    def subscribe(self, *channels) -> None:
+        pass
+
+    def unsubscribe(self, *channels) -> None:
+        pass
+
+    def get_message(self, timeout: Optional[float] = None) -> None:
+        return None
+
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis") -> None:
+        self.redis = redis
+        self.commands: List[tuple] = []
+
+    def __getattr__(self, name: str):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+    def execute(self) -> list:
+        return [
+            getattr(self.redis, name)(*args, **kwargs)
+            for name, args, kwargs in self.commands
+        ]
+
+class FakeRedis:
+    """Keeps values in a dict, and counts every command"""
+
+    def __init__(self) -> None:
+        self.data: Dict[str, object] = {}
+        self.published: List[tuple] = []
+        self.commands = 0
+
+    def pubsub(self) -> FakePubSub:
+        return FakePubSub()
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        return FakePipeline(self)
+
+    def set(self, key: str, value, ex: Optional[int] = None) -> bool:
+        self.commands += 1
+        self.data[key] = value
+        return True
+
+    def get(self, key: str):
+        self.commands += 1
+        return self.data.get(key)
+
+    def delete(self, *keys: str) -> int:
+        self.commands += 1
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def hset(self, key: str, field=None, value=None, mapping: Optional[dict] = None) -> int:
+        self.commands += 1
+        values = self.data.setdefault(key, {})
+        values.update(mapping or {field: value})
+        return len(mapping or (field,))
+
+    def expire(self, key: str, seconds: int) -> bool:
+        self.commands += 1
+        return key in self.data
+
+    def publish(self, channel: str, message) -> int:
+        self.commands += 1
+        self.published.append((channel, message))
+        return 0
+
+    def xadd(self, name: str, fields: dict, **kwargs) -> bytes:
+        self.commands += 1
+        self.data.setdefault(name, []).append(fields)
+        return f"{int(time.time() * 1000)}-0".encode()
+
+class FakePlayers(dict):
+    """Online players by their id"""
+
+    def add(self, player: Player) -> None:
+        self[player.id] = player
+
+    def by_id(self, id: int) -> Optional[Player]:
+        return self.get(id)
+
+class FakeBancho:
+    def __init__(self) -> None:
+        self.spectating: Optional[Player] = None
+        self.players = FakePlayers()
+        self.connected = True
+        self.stats_requests = 0
+        self.retry_delay = 5
+
+    def connect(self) -> None:
+        self.connected = True
+
+    def request_stats(self, ids: List[int]) -> None:
+        self.stats_requests += 1
+
+    def start_spectating(self, target: Player) -> None:
+        self.spectating = target
+
+    def stop_spectating(self) -> None:
+        self.spectating = None
+
+class FakeExecutor:
+    """Runs redis calls right away, instead of on a background thread"""
+
+    def submit(self, function, *args) -> None:
+        function(*args)
+
+    def execute(self, command: str, *args) -> None:
+        getattr(session.redis, command)(*args)
+
+class FakeGame:
+    """Provides the parts of `osu.Game`, that slots and the replay manager use"""
+
+    def __init__(self, server: str = "ppy.sh", version: int = 20240101, username: str = "spectator") -> None:
+        self.server = server
+        self.username = username
+        self.version_number = version
+        self.logger = logging.getLogger("osu!")
+        self.bancho = FakeBancho()
+
+class SnapshotCollector:
+    """Takes the place of the finalizer, and keeps every snapshot"""
+
+    def __init__(self) -> None:
+        self.snapshots: List["ReplaySnapshot"] = []
+
+    def submit(self, snapshot: "ReplaySnapshot") -> None:
+        self.snapshots.append(snapshot)
+
+def setup() -> FakeRedis:
+    """Point the session at a fake redis"""
+    redis = FakeRedis()
+    session.redis = redis
+    session.queue = EventQueue("spectator", redis)
+    session.storage = RedisStorage(redis)
+    return redis
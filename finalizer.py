@@ -0,0 +1,82 @@
+from typing import TYPE_CHECKING, List, Optional
+from threading import Thread
+
+if TYPE_CHECKING:
+    from replays import ReplaySnapshot
+
+import logging
+import metrics
+import queue
+
+class ReplayFinalizer:
+    """Builds and submits finished replays on a bounded pool of worker threads
+
+    Replays of the same player are always routed to the same worker,
+    so they get submitted in the order they were recorded.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 8, timeout: float = 5) -> None:
+        self.timeout = timeout
+        self.logger = logging.getLogger("finalizer")
+
+        self.queues: List[queue.Queue] = [
+            queue.Queue(maxsize=queue_size)
+            for _ in range(max(1, workers))
+        ]
+        self.threads: List[Thread] = [
+            Thread(
+                target=self.worker,
+                args=(replays,),
+                name=f"finalizer-{index}",
+                daemon=True
+            )
+            for index, replays in enumerate(self.queues)
+        ]
+
+        for thread in self.threads:
+            thread.start()
+
+    @property
+    def pending(self) -> int:
+        return sum(replays.qsize() for replays in self.queues)
+
+    def submit(self, snapshot: "ReplaySnapshot") -> None:
+        """Queue a replay for finalization, blocking while the worker is busy"""
+        replays = self.queues[snapshot.score.player.id % len(self.queues)]
+
+        try:
+            replays.put(snapshot, timeout=self.timeout)
+        except queue.Full:
+            # Finalizing on this thread could overtake earlier replays of
+            # the player, so keep waiting for the worker instead
+            self.logger.warning(
+                f"Finalizer queue is full for more than {self.timeout}s, waiting for the worker..."
+            )
+            replays.put(snapshot)
+
+    def finalize(self, snapshot: "ReplaySnapshot") -> None:
+        try:
+            snapshot.finalize()
+            self.logger.info(f"Replay was submitted.")
+        except Exception as e:
+            self.logger.error(f"Failed to finalize replay: {e}", exc_info=e)
+            metrics.replays_failed.inc()
+
+    def worker(self, replays: queue.Queue) -> None:
+        while True:
+            snapshot: Optional["ReplaySnapshot"] = replays.get()
+
+            if snapshot is None:
+                break
+
+            self.finalize(snapshot)
+
+    def shutdown(self) -> None:
+        """Wait for every queued replay to be submitted"""
+        self.logger.info(f"Waiting for {self.pending} replay(s) to finalize...")
+
+        for replays in self.queues:
+            replays.put(None)
+
+        for thread in self.threads:
+            thread.join()
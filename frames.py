@@ -0,0 +1,150 @@
+from osu.objects import ReplayFrame, ScoreFrame
+from typing import List, Optional, Sequence
+from itertools import chain
+from operator import sub
+from array import array
+
+# Pre-formatted life bar values for every possible hp byte
+HP_VALUES = [str(min(1.0, hp / 200)) for hp in range(256)]
+
+class FrameBuffer:
+    """Keeps track of the frames of a replay, while they are delta-encoded
+
+    Frames are only kept in their compressed form, so this only needs to
+    remember how many there were, and the time of the last one.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.last_time = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def encode(self, frames: List[ReplayFrame]) -> str:
+        """Format frames as delta-encoded replay data, following the previous frames"""
+        time = [frame.time for frame in frames]
+
+        data = encode_frames(
+            time,
+            [frame.x for frame in frames],
+            [frame.y for frame in frames],
+            [frame.button_state.value for frame in frames],
+            self.last_time
+        )
+
+        self.count += len(frames)
+        self.last_time = time[-1]
+        return data
+
+def encode_frames(time: Sequence[int], x: Sequence[float], y: Sequence[float], buttons: Sequence[int], previous: int = 0) -> str:
+    return ",".join(
+        map(
+            "{}|{}|{}|{}".format,
+            map(sub, time, chain((previous,), time)),
+            x,
+            y,
+            buttons
+        )
+    )
+
+class ScoreFrameBuffer:
+    """Stores the time and hp of every score frame, as well as the latest frame"""
+
+    def __init__(self) -> None:
+        self.time = array("i")
+        self.hp = array("B")
+        self.last: Optional[ScoreFrame] = None
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self) * (self.time.itemsize + self.hp.itemsize)
+
+    def append(self, frame: ScoreFrame) -> None:
+        self.time.append(frame.time)
+        self.hp.append(frame.current_hp)
+        self.last = frame
+
+    def hp_graph(self, mode: str = "full", resolution: int = 0) -> str:
+        """Format the life bar graph
+
+        `mode` can be one of:
+            `full`: Every score frame is used
+            `interval`: The last frame of every `resolution` milliseconds is used
+            `lttb`: Downsampled to `resolution` points, while preserving the shape
+        """
+        if mode == "interval":
+            indices = self.interval_indices(resolution)
+        elif mode == "lttb":
+            indices = self.lttb_indices(resolution)
+        else:
+            indices = range(len(self))
+
+        return ",".join(
+            map(
+                "{}|{}".format,
+                map(self.time.__getitem__, indices),
+                map(HP_VALUES.__getitem__, map(self.hp.__getitem__, indices))
+            )
+        )
+
+    def interval_indices(self, interval: int) -> List[int]:
+        """Index of the first frame, and the last frame inside every interval"""
+        if not self.time or interval <= 0:
+            return list(range(len(self)))
+
+        indices = [0]
+        bucket = self.time[0] // interval
+
+        for index, time in enumerate(self.time):
+            if time // interval != bucket:
+                bucket = time // interval
+
+                if indices[-1] != index - 1:
+                    indices.append(index - 1)
+
+        if indices[-1] != len(self) - 1:
+            indices.append(len(self) - 1)
+
+        return indices
+
+    def lttb_indices(self, threshold: int) -> List[int]:
+        """Largest-Triangle-Three-Buckets downsampling of the hp graph"""
+        length = len(self)
+
+        if threshold >= length or threshold < 3:
+            return list(range(length))
+
+        time, hp = self.time, self.hp
+        every = (length - 2) / (threshold - 2)
+        indices = [0]
+        previous = 0
+
+        for bucket in range(threshold - 2):
+            start = int(bucket * every) + 1
+            end = int((bucket + 1) * every) + 1
+
+            # Average point of the next bucket
+            next_end = min(int((bucket + 2) * every) + 1, length)
+            count = next_end - end
+            average_time = sum(time[end:next_end]) / count
+            average_hp = sum(hp[end:next_end]) / count
+
+            previous_time = time[previous]
+            previous_hp = hp[previous]
+
+            # Select the point, that forms the largest triangle
+            previous = max(
+                range(start, end),
+                key=lambda index: abs(
+                    (previous_time - average_time) * (hp[index] - previous_hp) -
+                    (previous_time - time[index]) * (average_hp - previous_hp)
+                )
+            )
+            indices.append(previous)
+
+        indices.append(length - 1)
+        return indices
@@ -0,0 +1,123 @@
+from typing import Set
+from redis import Redis
+
+# Leases expire based on the clock of the redis server,
+# so that workers with a drifting clock cannot steal them
+NOW = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+"""
+
+# KEYS: leases (player id -> expiry), owners (player id -> owner)
+# ARGV: player id, owner, ttl
+CLAIM_SCRIPT = NOW + """
+local expiry = now + tonumber(ARGV[3])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now)
+
+for _, member in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], member)
+    redis.call('HDEL', KEYS[2], member)
+end
+
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    if redis.call('HGET', KEYS[2], ARGV[1]) == ARGV[2] then
+        redis.call('ZADD', KEYS[1], expiry, ARGV[1])
+        return 1
+    end
+    return 0
+end
+
+redis.call('ZADD', KEYS[1], expiry, ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+return 1
+"""
+
+# KEYS: leases, owners
+# ARGV: player id, owner, ttl
+RENEW_SCRIPT = NOW + """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+
+if not score or tonumber(score) <= now then
+    return 0
+end
+
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+return 1
+"""
+
+# KEYS: leases, owners
+# ARGV: player id, owner
+RELEASE_SCRIPT = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+return 1
+"""
+
+# KEYS: leases
+CLAIMED_SCRIPT = NOW + """
+return redis.call('ZRANGEBYSCORE', KEYS[1], '(' .. now, '+inf')
+"""
+
+class Leases:
+    """Spectating targets, reserved by workers for a limited amount of time
+
+    A lease has to be renewed before it runs out,
+    otherwise the target can be claimed by another worker.
+    """
+
+    def __init__(self, connection: Redis, ttl: float = 30) -> None:
+        self.redis = connection
+        self.ttl = ttl
+
+        self.claim_script = self.redis.register_script(CLAIM_SCRIPT)
+        self.renew_script = self.redis.register_script(RENEW_SCRIPT)
+        self.release_script = self.redis.register_script(RELEASE_SCRIPT)
+        self.claimed_script = self.redis.register_script(CLAIMED_SCRIPT)
+
+    def keys(self, server: str) -> list:
+        return [
+            f"spectating:{server}:leases",
+            f"spectating:{server}:owners"
+        ]
+
+    def claim(self, server: str, player_id: int, owner: str) -> bool:
+        """Reserve a player, returns `False` if somebody else holds the lease"""
+        return bool(
+            self.claim_script(
+                keys=self.keys(server),
+                args=[player_id, owner, self.ttl]
+            )
+        )
+
+    def renew(self, server: str, player_id: int, owner: str) -> bool:
+        """Extend a lease, returns `False` if it was lost in the meantime"""
+        return bool(
+            self.renew_script(
+                keys=self.keys(server),
+                args=[player_id, owner, self.ttl]
+            )
+        )
+
+    def release(self, server: str, player_id: int, owner: str) -> bool:
+        return bool(
+            self.release_script(
+                keys=self.keys(server),
+                args=[player_id, owner]
+            )
+        )
+
+    def claimed(self, server: str) -> Set[int]:
+        """Ids of every player with an active lease"""
+        return {
+            int(id) for id in self.claimed_script(
+                keys=self.keys(server)[:1]
+            )
+        }
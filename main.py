@@ -1,13 +1,29 @@
 
-from replays import ReplayManager
-from events import EventQueue
+import time
+
+# Taken before anything else is imported, to measure the time until the first frame
+started = time.time()
+
+from redis import ConnectionPool
+from finalizer import ReplayFinalizer
+from scheduler import StatsScheduler
+from executor import RedisExecutor
+from slots import Slot, Slots
+from objects import deliver
+from stats import StatsWriter
+from leases import Leases
+from shards import Shards
+from checkpoint import Checkpoints
+from events import EventQueue, CODECS
 from typing import Optional
-from redis import Redis
 from osu import Game
 
 import argparse
 import logging
+import profiling
+import metrics
 import session
+import os
 
 logging.basicConfig(
     level=logging.INFO,
@@ -29,8 +45,20 @@ def load_config() -> Optional[dict]:
     )
     parser.add_argument(
         '--server',
-        default='ppy.sh',
-        help='Specify a private server to use'
+        action='append',
+        dest='servers',
+        help='Specify a private server to use (can be used multiple times)'
+    )
+    parser.add_argument(
+        '--slots',
+        default=1,
+        type=int,
+        help='Amount of players to spectate at once, per server'
+    )
+    parser.add_argument(
+        '--worker-id',
+        default=None,
+        help='Identifies this process when claiming targets, must be unique and stay the same across restarts (defaults to the hostname)'
     )
     parser.add_argument(
         '--redis-host',
@@ -52,63 +80,462 @@ def load_config() -> Optional[dict]:
         default=0,
         help='Specify the Redis database'
     )
+    parser.add_argument(
+        '--redis-queue-size',
+        default=10_000,
+        type=int,
+        help='Amount of redis calls, that packet handlers can queue up'
+    )
+    parser.add_argument(
+        '--event-codec',
+        default='repr',
+        choices=list(CODECS),
+        help='Format used to submit events. Only switch away from the legacy "repr" format, once every consumer accepts the new one (it is always accepted when decoding)'
+    )
+    parser.add_argument(
+        '--event-transport',
+        default='pubsub',
+        choices=['pubsub', 'stream'],
+        help='Submit events over pubsub, or over a durable redis stream'
+    )
+    parser.add_argument(
+        '--event-stream-maxlen',
+        default=100_000,
+        type=int,
+        help='Approximate amount of events to keep in the stream'
+    )
+    parser.add_argument(
+        '--max-rank',
+        default=250,
+        type=int,
+        help='Only spectate players ranked below this rank'
+    )
+    parser.add_argument(
+        '--lease-ttl',
+        default=30,
+        type=float,
+        help='Seconds until a spectating target can be claimed by another worker'
+    )
+    parser.add_argument(
+        '--reconnect-delay',
+        default=5,
+        type=float,
+        help='Seconds to wait before reconnecting to bancho, doubled after every failed attempt'
+    )
+    parser.add_argument(
+        '--max-reconnect-delay',
+        default=300,
+        type=float,
+        help='Maximum seconds to wait before reconnecting to bancho'
+    )
+    parser.add_argument(
+        '--checkpoint-ttl',
+        default=600,
+        type=int,
+        help='Seconds a restarted worker can resume its previous spectating target'
+    )
+    parser.add_argument(
+        '--heartbeat-interval',
+        default=10,
+        type=float,
+        help='Seconds between heartbeats, that split candidates between instances'
+    )
+    parser.add_argument(
+        '--stats-interval',
+        default=0.5,
+        type=float,
+        help='Seconds to collect stats updates, before writing them to Redis'
+    )
+    parser.add_argument(
+        '--stats-batch-size',
+        default=500,
+        type=int,
+        help='Amount of players, that will cause stats to be written immediately'
+    )
+    parser.add_argument(
+        '--stats-request-rate',
+        default=1,
+        type=float,
+        help='Maximum amount of batched stats requests per second, for each slot'
+    )
+    parser.add_argument(
+        '--stats-request-batch-size',
+        default=32,
+        type=int,
+        help='Maximum amount of players inside one stats request'
+    )
+    parser.add_argument(
+        '--stats-refresh-count',
+        default=16,
+        type=int,
+        help='Amount of top ranked players, whose stats are refreshed in the background'
+    )
+    parser.add_argument(
+        '--stats-refresh-interval',
+        default=60,
+        type=float,
+        help='Seconds between background refreshes of the top ranked players'
+    )
+    parser.add_argument(
+        '--replay-storage',
+        default='redis',
+        choices=['redis', 'disk'],
+        help='Store replay files inside Redis, or inside a directory'
+    )
+    parser.add_argument(
+        '--replay-directory',
+        default='replays',
+        help='Directory used by the disk replay storage'
+    )
+    parser.add_argument(
+        '--replay-max-size',
+        default=10240,
+        type=int,
+        help='Maximum size of the replay directory in megabytes'
+    )
+    parser.add_argument(
+        '--replay-max-age',
+        default=96,
+        type=int,
+        help='Hours until replay files expire'
+    )
+    parser.add_argument(
+        '--outbox',
+        default=None,
+        help='Journal file, that keeps scores until redis accepted them'
+    )
+    parser.add_argument(
+        '--outbox-max-size',
+        default=512,
+        type=int,
+        help='Maximum size of the scores inside the outbox in megabytes'
+    )
+    parser.add_argument(
+        '--replay-memory-limit',
+        default=16,
+        type=float,
+        help='Megabytes of compressed frames a single replay can buffer in memory, before they are spilled to disk (0 = unlimited). The compressor state is not included'
+    )
+    parser.add_argument(
+        '--replay-spill-directory',
+        default=None,
+        help='Directory for spilled replay buffers (defaults to the system temp directory)'
+    )
+    parser.add_argument(
+        '--replay-inactivity-timeout',
+        default=300,
+        type=float,
+        help='Seconds without frames, until a replay gets finished'
+    )
+    parser.add_argument(
+        '--hp-graph',
+        default='full',
+        choices=['full', 'interval', 'lttb'],
+        help='Downsampling of the life bar graph inside replay files'
+    )
+    parser.add_argument(
+        '--hp-graph-resolution',
+        default=None,
+        type=int,
+        help='Milliseconds per point for "interval" (1000), or amount of points for "lttb" (500)'
+    )
+    parser.add_argument(
+        '--capture-directory',
+        default=None,
+        help='Record every spectator packet into this directory'
+    )
+    parser.add_argument(
+        '--finalizer-workers',
+        default=2,
+        type=int,
+        help='Amount of threads used to build and submit replays'
+    )
+    parser.add_argument(
+        '--finalizer-queue-size',
+        default=8,
+        type=int,
+        help='Amount of replays each finalizer thread can queue up'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        default=None,
+        type=int,
+        help='Serve prometheus metrics on this port'
+    )
+    parser.add_argument(
+        '--slow-handler-threshold',
+        default=100,
+        type=float,
+        help='Log packet handlers & tasks, that take longer than this many milliseconds'
+    )
+    parser.add_argument(
+        '--profile-directory',
+        default='profiles',
+        help='Directory, that profiles requested over the api queue are written to'
+    )
 
     args = parser.parse_args()
     dict = args.__dict__
 
+    hp_graph_resolution = dict["hp_graph_resolution"] or {
+        "interval": 1000,
+        "lttb": 500
+    }.get(dict["hp_graph"], 0)
+
     return {
         "username": dict["<username>"],
         "password": dict["<password>"],
-        "server": dict["server"],
+        "servers": dict["servers"] or ["ppy.sh"],
+        "slots": dict["slots"],
+        "worker_id": dict["worker_id"],
         "redis": {
             "host": dict["redis_host"],
             "port": dict["redis_port"],
             "password": dict["redis_password"],
-            "db": dict["redis_db"]
+            "db": dict["redis_db"],
+            "queue_size": dict["redis_queue_size"]
+        },
+        "events": {
+            "codec": dict["event_codec"],
+            "transport": dict["event_transport"],
+            "maxlen": dict["event_stream_maxlen"]
+        },
+        "max_rank": dict["max_rank"],
+        "lease_ttl": dict["lease_ttl"],
+        "heartbeat_interval": dict["heartbeat_interval"],
+        "reconnect": {
+            "delay": dict["reconnect_delay"],
+            "max_delay": dict["max_reconnect_delay"]
+        },
+        "checkpoint_ttl": dict["checkpoint_ttl"],
+        "stats": {
+            "interval": dict["stats_interval"],
+            "batch_size": dict["stats_batch_size"],
+            "request_rate": dict["stats_request_rate"],
+            "request_batch_size": dict["stats_request_batch_size"],
+            "refresh_count": dict["stats_refresh_count"],
+            "refresh_interval": dict["stats_refresh_interval"]
+        },
+        "storage": {
+            "type": dict["replay_storage"],
+            "directory": dict["replay_directory"],
+            "max_size": dict["replay_max_size"] * 1024 ** 2,
+            "max_age": dict["replay_max_age"] * 60 * 60
+        },
+        "outbox": {
+            "path": dict["outbox"],
+            "max_size": dict["outbox_max_size"] * 1024 ** 2
+        },
+        "replays": {
+            "memory_limit": int(dict["replay_memory_limit"] * 1024 ** 2),
+            "spill_directory": dict["replay_spill_directory"],
+            "inactivity_timeout": dict["replay_inactivity_timeout"]
+        },
+        "hp_graph": (dict["hp_graph"], hp_graph_resolution),
+        "capture_directory": dict["capture_directory"],
+        "finalizer": {
+            "workers": dict["finalizer_workers"],
+            "queue_size": dict["finalizer_queue_size"]
+        },
+        "metrics_port": dict["metrics_port"],
+        "profiling": {
+            "slow_threshold": dict["slow_handler_threshold"] / 1000,
+            "directory": dict["profile_directory"]
         }
     }
 
 def main():
+    session.started = started
     session.config = load_config()
 
-    session.game = Game(
-        session.config["username"],
-        session.config["password"],
-        server=session.config["server"],
-        tournament=True,
-        disable_chat_logging=True
+    session.redis = metrics.InstrumentedRedis(
+        connection_pool=ConnectionPool(
+            host=session.config["redis"]["host"],
+            port=session.config["redis"]["port"],
+            password=session.config["redis"]["password"],
+            db=session.config["redis"]["db"]
+        )
     )
 
-    session.redis = Redis(
-        host=session.config["redis"]["host"],
-        port=session.config["redis"]["port"],
-        password=session.config["redis"]["password"],
-        db=session.config["redis"]["db"]
+    session.executor = RedisExecutor(
+        session.redis,
+        size=session.config["redis"]["queue_size"]
     )
+    session.executor.start()
+
+    if not session.executor.ping():
+        # Don't log into bancho, if nothing can be written to redis
+        session.logger.error("Redis is not reachable, exiting...")
+        exit(1)
 
     session.queue = EventQueue(
         "spectator",
-        session.redis
+        session.redis,
+        codec=CODECS[session.config["events"]["codec"]](),
+        transport=session.config["events"]["transport"],
+        maxlen=session.config["events"]["maxlen"]
     )
 
     session.api_queue = EventQueue(
         "api",
-        session.redis
+        session.redis,
+        codec=CODECS[session.config["events"]["codec"]]()
     )
 
-    session.manager = ReplayManager(session.game)
+    if session.config["storage"]["type"] == "disk":
+        from storage import DiskStorage
+
+        session.storage = DiskStorage(
+            session.redis,
+            session.config["storage"]["directory"],
+            max_size=session.config["storage"]["max_size"],
+            max_age=session.config["storage"]["max_age"]
+        )
+    else:
+        from storage import RedisStorage
+
+        session.storage = RedisStorage(
+            session.redis,
+            max_age=session.config["storage"]["max_age"]
+        )
+
+    if session.config["outbox"]["path"]:
+        from outbox import Outbox
+
+        # Scores from before a restart get delivered first
+        session.outbox = Outbox(
+            session.config["outbox"]["path"],
+            deliver,
+            max_size=session.config["outbox"]["max_size"]
+        )
+        session.outbox.start()
+
+    session.finalizer = ReplayFinalizer(
+        workers=session.config["finalizer"]["workers"],
+        queue_size=session.config["finalizer"]["queue_size"]
+    )
+
+    session.stats = StatsWriter(
+        session.redis,
+        session.queue,
+        interval=session.config["stats"]["interval"],
+        size=session.config["stats"]["batch_size"]
+    )
+    session.stats.start()
+
+    session.leases = Leases(
+        session.redis,
+        ttl=session.config["lease_ttl"]
+    )
+
+    profiling.timings.threshold = session.config["profiling"]["slow_threshold"]
+    profiling.sampler.directory = session.config["profiling"]["directory"]
+
+    session.shards = Shards(
+        session.redis,
+        slots=session.config["slots"] * len(session.config["servers"]),
+        ttl=session.config["heartbeat_interval"] * 3,
+        interval=session.config["heartbeat_interval"]
+    )
+    session.shards.start()
+
+    session.checkpoints = Checkpoints(
+        session.redis,
+        ttl=session.config["checkpoint_ttl"]
+    )
+
+    session.slots = Slots()
     session.logger.info("Loading tasks...")
 
     import tasks
 
-    session.game.run()
+    version = None
 
-    # Remove player id from spectating list, after game closes
-    if session.manager.spectating:
-        session.redis.lrem(
-            f"spectating:{session.game.server}", 1,
-            session.manager.spectating.id
-        )
+    for server in session.config["servers"]:
+        for index in range(session.config["slots"]):
+            game = Game(
+                session.config["username"],
+                session.config["password"],
+                server=server,
+                version=version,
+                tournament=True,
+                disable_chat_logging=True
+            )
+            version = game.version_number
+
+            slot = Slot(
+                index,
+                game,
+                session.finalizer,
+                session.config["max_rank"],
+                session.config["hp_graph"],
+                memory_limit=session.config["replays"]["memory_limit"],
+                spill_directory=session.config["replays"]["spill_directory"],
+                inactivity_timeout=session.config["replays"]["inactivity_timeout"],
+                reconnect_delay=session.config["reconnect"]["delay"],
+                max_reconnect_delay=session.config["reconnect"]["max_delay"],
+                worker_id=session.config["worker_id"],
+                scheduler=StatsScheduler(
+                    rate=session.config["stats"]["request_rate"],
+                    batch_size=session.config["stats"]["request_batch_size"],
+                    refresh_count=session.config["stats"]["refresh_count"],
+                    refresh_interval=session.config["stats"]["refresh_interval"]
+                )
+            )
+            session.slots.add(slot)
+
+            if session.config["capture_directory"]:
+                from capture import PacketRecorder
+
+                slot.recorder = PacketRecorder(
+                    os.path.join(
+                        session.config["capture_directory"],
+                        f"{server}-{index}-{int(time.time())}.cap"
+                    ),
+                    game.version_number,
+                    session.config["hp_graph"]
+                )
+
+            tasks.register(slot)
+
+    for slot in session.slots:
+        slot.start()
+
+    session.api_queue.start()
+
+    if session.config["metrics_port"]:
+        metrics.serve(session.config["metrics_port"])
+
+    try:
+        for slot in session.slots:
+            while slot.thread.is_alive():
+                slot.thread.join(timeout=1)
+    except KeyboardInterrupt:
+        session.logger.warning("Stopping slots...")
+
+    for slot in session.slots:
+        slot.stop()
+        slot.thread.join()
+
+        # Release spectating target, after game closes
+        if slot.spectating:
+            session.leases.release(
+                slot.server,
+                slot.spectating.id,
+                slot.owner
+            )
+
+    session.api_queue.stop()
+    session.shards.shutdown()
+
+    # Write pending stats & submit replays that are still being processed
+    session.stats.shutdown()
+    session.finalizer.shutdown()
+
+    if session.outbox:
+        session.outbox.shutdown()
+
+    session.executor.shutdown()
 
 if __name__ == "__main__":
     main()
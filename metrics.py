@@ -0,0 +1,310 @@
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from threading import Lock, Thread
+from redis import Redis
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+import logging
+import session
+import time
+
+Labels = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+def format_labels(names: List[str], values: Labels, extra: str = "") -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+
+    if extra:
+        labels.append(extra)
+
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Optional[List[str]] = None) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels or []
+        self.lock = Lock()
+
+    def key(self, labels: dict) -> Labels:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}"
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Optional[List[str]] = None) -> None:
+        super().__init__(name, help, labels)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            values = list(self.values.items())
+
+        for key, value in values:
+            yield f"{self.name}{format_labels(self.labels, key)} {value}"
+
+class Gauge(Metric):
+    """Gauge, whose values are either set directly or collected by a callback on every scrape"""
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Optional[List[str]] = None,
+        callback: Optional[Callable[[], Dict[Labels, float]]] = None
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.callback = callback
+        self.values: Dict[Labels, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            values = dict(self.values)
+
+        if self.callback:
+            values.update(self.callback())
+
+        for key, value in values.items():
+            yield f"{self.name}{format_labels(self.labels, key)} {value}"
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Optional[List[str]] = None,
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self.counts: Dict[Labels, List[int]] = {}
+        self.sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+
+        with self.lock:
+            counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            self.sums[key] = self.sums.get(key, 0.0) + value
+
+            for index, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            counts = {key: list(value) for key, value in self.counts.items()}
+            sums = dict(self.sums)
+
+        for key, values in counts.items():
+            total = 0
+
+            for bucket, count in zip(self.buckets + (float("inf"),), values):
+                total += count
+                le = "+Inf" if bucket == float("inf") else repr(bucket)
+                labels = format_labels(self.labels, key, f'le="{le}"')
+                yield f"{self.name}_bucket{labels} {total}"
+
+            yield f"{self.name}_sum{format_labels(self.labels, key)} {sums[key]}"
+            yield f"{self.name}_count{format_labels(self.labels, key)} {total}"
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Optional[List[str]] = None) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Optional[List[str]] = None, callback=None) -> Gauge:
+        return self.register(Gauge(name, help, labels, callback))
+
+    def histogram(self, name: str, help: str, labels: Optional[List[str]] = None, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+registry = Registry()
+
+frames = registry.counter(
+    "spectator_frames_total",
+    "Replay frames received",
+    ["slot"]
+)
+replays_created = registry.counter(
+    "spectator_replays_created_total",
+    "Replays that were submitted"
+)
+replays_rejected = registry.counter(
+    "spectator_replays_rejected_total",
+    "Replays that were not saved",
+    ["reason"]
+)
+replays_failed = registry.counter(
+    "spectator_replays_failed_total",
+    "Replays that could not be finalized"
+)
+finalize_seconds = registry.histogram(
+    "spectator_finalize_seconds",
+    "Time spent building and submitting a replay"
+)
+compression_seconds = registry.histogram(
+    "spectator_compression_seconds",
+    "Time spent flushing the compressed frame stream"
+)
+redis_seconds = registry.histogram(
+    "spectator_redis_command_seconds",
+    "Latency of redis commands",
+    ["command"]
+)
+redis_errors = registry.counter(
+    "spectator_redis_errors_total",
+    "Redis commands that raised an error",
+    ["command"]
+)
+
+def slot_values(attribute: str) -> Callable[[], Dict[Labels, float]]:
+    return lambda: {
+        (slot.name,): getattr(slot, attribute)
+        for slot in session.slots or []
+    }
+
+def queue_values(attribute: str) -> Callable[[], Dict[Labels, float]]:
+    return lambda: {
+        (queue.name,): getattr(queue, attribute)
+        for queue in (session.queue, session.api_queue) if queue
+    }
+
+idle_seconds = registry.gauge(
+    "spectator_idle_seconds",
+    "Seconds a slot spent without a spectating target",
+    ["slot"],
+    slot_values("idle_time")
+)
+idle_per_hour = registry.gauge(
+    "spectator_idle_seconds_per_hour",
+    "Seconds a slot spent without a spectating target, per hour over the last hour",
+    ["slot"],
+    slot_values("idle_per_hour")
+)
+buffer_bytes = registry.gauge(
+    "spectator_replay_buffer_bytes",
+    "Size of the replay buffer of a slot",
+    ["slot"],
+    slot_values("memory")
+)
+startup_seconds = registry.gauge(
+    "spectator_startup_seconds",
+    "Seconds from the start of the process until the first frame of a slot",
+    ["slot"],
+    slot_values("startup_time")
+)
+spilled_bytes = registry.gauge(
+    "spectator_replay_spilled_bytes",
+    "Size of the replay buffer of a slot, that was spilled to disk",
+    ["slot"],
+    slot_values("spilled")
+)
+queue_backlog = registry.gauge(
+    "spectator_queue_backlog",
+    "Events received in the last batch of a queue",
+    ["queue"],
+    queue_values("backlog")
+)
+finalizer_pending = registry.gauge(
+    "spectator_finalizer_pending",
+    "Replays waiting to be finalized",
+    callback=lambda: {(): session.finalizer.pending} if session.finalizer else {}
+)
+
+class InstrumentedRedis(Redis):
+    """Redis client, that measures the latency of every command"""
+
+    def execute_command(self, *args, **options):
+        command = str(args[0]).upper() if args else "UNKNOWN"
+        start = time.perf_counter()
+
+        try:
+            return super().execute_command(*args, **options)
+        except Exception:
+            redis_errors.inc(command=command)
+            raise
+        finally:
+            redis_seconds.observe(time.perf_counter() - start, command=command)
+
+def serve(port: int, host: str = "0.0.0.0") -> "ThreadingHTTPServer":
+    """Serve the prometheus text format on `/metrics` in a background thread"""
+    # Only imported when metrics are enabled, to keep startup fast
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.getLogger("metrics").info(f"Serving metrics on port {port}")
+    return server
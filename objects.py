@@ -1,9 +1,10 @@
 
-from osu.objects import ScoreFrame, Player, Status
+from osu.objects import Player, Status
 from osu.bancho.constants import Mods, Mode
 
+from frames import ScoreFrameBuffer
 from datetime import datetime
-from typing import List
+from typing import List, Tuple
 
 import hashlib
 import session
@@ -12,20 +13,24 @@ import json
 class Score:
     def __init__(
         self,
-        score_frames: List[ScoreFrame],
+        score_frames: ScoreFrameBuffer,
         player: Player,
         status: Status,
         passed: bool,
+        server: str,
+        hp_graph: Tuple[str, int] = ("full", 0),
     ) -> None:
+        self.hp_graph_mode, self.hp_graph_resolution = hp_graph
+        self.server = server
         self.player = player
         self.status = status
         self.passed = passed
         self.frames = score_frames
-        self.data = self.frames[-1]
+        self.data = self.frames.last
 
     @property
     def checksum(self) -> str:
-        frame = self.frames[-1]
+        frame = self.data
         return hashlib.md5(
             f"{frame.max_combo}osu{self.player.name}{self.status.checksum}{frame.total_score}{self.grade}".encode()
         ).hexdigest()
@@ -140,19 +145,28 @@ class Score:
 
     @property
     def hp_graph(self) -> str:
-        return ",".join(
-            [
-                f"{frame.time}|{min(1.0, frame.current_hp / 200)}"
-                for frame in self.frames
-            ]
+        return self.frames.hp_graph(
+            self.hp_graph_mode,
+            self.hp_graph_resolution
         )
 
     def submit(self, replay_file: bytes) -> None:
-        """Submit the score data to the queue, and store the replay file in cache"""
-        session.queue.submit(
-            "score",
+        """Submit the score data to the queue, and store the replay file in cache
+
+        With an outbox, both are written to disk first, and
+        delivered in the background once redis accepts them.
+        """
+        if session.outbox and session.outbox.put(self.event, replay_file):
+            return
+
+        deliver(self.event, replay_file)
+
+    @property
+    def event(self) -> dict:
+        """Arguments of the score event"""
+        return dict(
             checksum=self.checksum,
-            server=session.game.server,
+            server=self.server,
             player=json.dumps({
                 "id": self.player.id,
                 "name": self.player.name,
@@ -195,8 +209,7 @@ class Score:
             })
         )
 
-        session.redis.set(
-            f'replays:{self.checksum}',
-            replay_file,
-            ex=60 * 60 * 96
-        )
+def deliver(event: dict, replay_file: bytes) -> None:
+    """Store the replay file, and announce the score"""
+    session.storage.store(event["checksum"], replay_file)
+    session.queue.submit("score", **event)
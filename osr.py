@@ -0,0 +1,295 @@
+"""Read replay files, and verify stored replays in bulk
+
+Usage:
+    python osr.py replays/
+    python osr.py --redis "replays:*" --redis-host localhost
+"""
+
+from typing import Iterator, List, Optional, Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+from osu.bancho.constants import Mods, Mode
+from osu.objects import ScoreFrame, Status
+from osu.bancho.streams import StreamIn
+
+from frames import ScoreFrameBuffer
+from objects import Score
+
+import argparse
+import lzma
+import os
+import re
+
+# Delta of the frame, that contains the seed of the replay
+SEED_FRAME = -12345
+
+# Frames are decompressed in chunks of this size
+CHUNK_SIZE = 64 * 1024
+
+Frame = Tuple[int, float, float, int]
+
+# Prefixes of stored replays, in front of their checksum
+STORAGE_PREFIX = re.compile(r"^(replays:|replay-[a-z]+_)")
+
+class ReplayError(ValueError):
+    pass
+
+@dataclass
+class ReplayFile:
+    """Replay file, in the layout written by `ReplaySnapshot.create_osr`"""
+    mode: Mode
+    version: int
+    beatmap_checksum: str
+    player_name: str
+    checksum: str
+    c300: int
+    c100: int
+    c50: int
+    cGeki: int
+    cKatu: int
+    cMiss: int
+    total_score: int
+    max_combo: int
+    perfect: bool
+    mods: Mods
+    hp_graph: str
+    ticks: int
+    compressed: bytes
+    score_id: int
+
+    @classmethod
+    def decode(cls, data: bytes) -> "ReplayFile":
+        stream = StreamIn(data)
+
+        try:
+            mode = Mode(stream.u8())
+            version = stream.s32()
+            beatmap_checksum = stream.string()
+            player_name = stream.string()
+            checksum = stream.string()
+            counts = [stream.u16() for _ in range(6)]
+            total_score = stream.s32()
+            max_combo = stream.u16()
+            perfect = stream.bool()
+            mods = Mods(stream.s32())
+            hp_graph = stream.string()
+            ticks = stream.s64()
+        except (OverflowError, ValueError) as e:
+            raise ReplayError(f"Truncated header: {e}")
+
+        try:
+            length = stream.s32()
+            compressed = stream.read(length)
+            score_id = stream.s64()
+        except OverflowError:
+            raise ReplayError("Truncated frame stream")
+
+        return cls(
+            mode, version, beatmap_checksum, player_name, checksum,
+            *counts, total_score, max_combo, perfect, mods,
+            hp_graph, ticks, compressed, score_id
+        )
+
+    def entries(self) -> Iterator[str]:
+        """Decompress the frame stream lazily, one "w|x|y|z" entry at a time"""
+        decompressor = lzma.LZMADecompressor(lzma.FORMAT_ALONE)
+        remainder = ""
+
+        try:
+            for offset in range(0, len(self.compressed), CHUNK_SIZE):
+                data = decompressor.decompress(self.compressed[offset:offset + CHUNK_SIZE])
+                *entries, remainder = (remainder + data.decode()).split(",")
+                yield from entries
+        except lzma.LZMAError as e:
+            raise ReplayError(f"Corrupted frame stream: {e}")
+
+        if not decompressor.eof:
+            raise ReplayError("Truncated frame stream")
+
+        if remainder:
+            yield remainder
+
+    def frames(self) -> Iterator[Frame]:
+        """Time, x, y & button state of every frame, excluding the seed frame"""
+        time = 0
+
+        for entry in self.entries():
+            delta, x, y, buttons = entry.split("|")
+
+            if int(delta) == SEED_FRAME:
+                continue
+
+            time += int(delta)
+            yield time, float(x), float(y), int(buttons)
+
+    def seed(self) -> Optional[int]:
+        for entry in self.entries():
+            delta, _, _, seed = entry.split("|")
+
+            if int(delta) == SEED_FRAME:
+                return int(seed)
+
+        return None
+
+    def score_checksums(self) -> Set[str]:
+        """Checksums this score could have, as the replay does not store if it was passed"""
+        frames = ScoreFrameBuffer()
+
+        frames.last = ScoreFrame(
+            0, 0, self.c300, self.c100, self.c50, self.cGeki, self.cKatu, self.cMiss,
+            self.total_score, self.max_combo, 0, self.perfect, 0, 0
+        )
+
+        if frames.last.total_hits <= 0:
+            # The grade, and with that the checksum, is based on the hits
+            raise ReplayError("No hits inside the header")
+
+        status = Status()
+        status.checksum = self.beatmap_checksum
+        status.mods = self.mods
+        status.mode = self.mode
+
+        # The checksum only depends on the name of the player
+        player = SimpleNamespace(name=self.player_name)
+
+        return {
+            Score(frames, player, status, passed, "").checksum
+            for passed in (True, False)
+        }
+
+def stored_checksum(name: str) -> str:
+    """Checksum of a replay, based on its filename or redis key"""
+    return STORAGE_PREFIX.sub("", os.path.basename(name).removesuffix(".osr"))
+
+def verify(name: str, data: bytes, min_frames: int = 250, tolerance: int = 5000) -> List[str]:
+    """Check a replay file, returning every problem that was found"""
+    try:
+        replay = ReplayFile.decode(data)
+    except ReplayError as e:
+        return [str(e)]
+
+    problems = []
+    expected = stored_checksum(name)
+
+    if expected != replay.checksum:
+        problems.append(f"Checksum mismatch: stored as {expected}, but replay has {replay.checksum}")
+
+    try:
+        if replay.total_score and replay.checksum not in replay.score_checksums():
+            problems.append("Checksum mismatch: does not match the score inside the header")
+    except ReplayError as e:
+        problems.append(str(e))
+
+    try:
+        frames = 0
+        last_time = 0
+
+        for time, *_ in replay.frames():
+            frames += 1
+            last_time = time
+
+        seed = replay.seed()
+    except ReplayError as e:
+        return problems + [str(e)]
+
+    if seed is None:
+        problems.append("Missing seed frame")
+
+    if frames <= min_frames:
+        problems.append(f"Too few frames: {frames}")
+
+    if replay.hp_graph:
+        hp_time = int(replay.hp_graph.rsplit(",", 1)[-1].split("|")[0])
+
+        if abs(hp_time - last_time) > tolerance:
+            problems.append(
+                f"Length mismatch: frames end at {last_time}ms, hp graph at {hp_time}ms"
+            )
+
+    return problems
+
+redis_connection = None
+
+def verify_file(path: str) -> Tuple[str, List[str]]:
+    with open(path, "rb") as f:
+        return path, verify(path, f.read())
+
+def verify_key(key: str, host: str, port: int, password: Optional[str], db: int) -> Tuple[str, List[str]]:
+    global redis_connection
+
+    if not redis_connection:
+        # One connection for every worker process
+        from redis import Redis
+        redis_connection = Redis(host=host, port=port, password=password, db=db)
+
+    if not (data := redis_connection.get(key)):
+        return key, ["Missing replay"]
+
+    return key, verify(key, data)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="spectator replay verifier")
+    parser.add_argument('directory', nargs='?', help='Directory with stored replays')
+    parser.add_argument('--redis', metavar='PATTERN', help='Verify redis keys matching this pattern instead')
+    parser.add_argument('--redis-host', default='localhost')
+    parser.add_argument('--redis-port', default=6379, type=int)
+    parser.add_argument('--redis-password', default=None)
+    parser.add_argument('--redis-db', default=0, type=int)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Replays to verify in parallel')
+    args = parser.parse_args()
+
+    if not args.directory and not args.redis:
+        parser.error("Either a directory or --redis is required")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        if args.redis:
+            from redis import Redis
+
+            connection = Redis(
+                host=args.redis_host,
+                port=args.redis_port,
+                password=args.redis_password,
+                db=args.redis_db
+            )
+            keys = [
+                key.decode() for key in connection.scan_iter(match=args.redis, count=1000)
+                if not key.endswith(b":index")
+            ]
+            settings = (args.redis_host, args.redis_port, args.redis_password, args.redis_db)
+            results = executor.map(
+                verify_key,
+                keys,
+                *([setting] * len(keys) for setting in settings),
+                chunksize=64
+            )
+        else:
+            paths = [
+                os.path.join(root, filename)
+                for root, _, filenames in os.walk(args.directory)
+                for filename in filenames
+                if filename.endswith(".osr")
+            ]
+            results = executor.map(verify_file, paths, chunksize=64)
+
+        total = 0
+        invalid = 0
+
+        for name, problems in results:
+            total += 1
+
+            if not problems:
+                continue
+
+            invalid += 1
+            print(f"{name}:")
+
+            for problem in problems:
+                print(f"  {problem}")
+
+    print(f"{total - invalid}/{total} replay(s) are valid")
+    exit(1 if invalid else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+from typing import BinaryIO, Callable, Dict, Iterator, Optional, Tuple
+from threading import Event, Lock, Thread
+
+import logging
+import metrics
+import struct
+import json
+import zlib
+import time
+import os
+
+RECORD_ENTRY = 0
+RECORD_ACK = 1
+
+# Length, crc32 of the payload & record type
+HEADER = struct.Struct("<IIB")
+
+Entry = Tuple[dict, bytes]
+
+# Offset & length of an entry's payload inside the journal
+Location = Tuple[int, int]
+
+depth = metrics.registry.gauge(
+    "spectator_outbox_depth",
+    "Scores waiting inside the outbox"
+)
+depth_bytes = metrics.registry.gauge(
+    "spectator_outbox_bytes",
+    "Size of the scores waiting inside the outbox"
+)
+
+def read_journal(file: BinaryIO) -> Iterator[Tuple[int, int, bytes]]:
+    """Read every intact record, stopping at the first corrupted or cut off one
+
+    Yields the offset of the payload, the record type and the payload.
+    """
+    while len(header := file.read(HEADER.size)) == HEADER.size:
+        length, checksum, record_type = HEADER.unpack(header)
+        offset = file.tell()
+        payload = file.read(length)
+
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+
+        yield offset, record_type, payload
+
+def encode_entry(entry_id: int, metadata: dict, blob: bytes) -> bytes:
+    data = json.dumps({"id": entry_id, "metadata": metadata}).encode()
+    return struct.pack("<I", len(data)) + data + blob
+
+def decode_entry(payload: bytes) -> Tuple[int, Entry]:
+    length, = struct.unpack_from("<I", payload)
+    data = json.loads(payload[4:4 + length])
+    return data["id"], (data["metadata"], payload[4 + length:])
+
+class Outbox:
+    """Append-only journal of scores, that were not accepted by redis yet
+
+    Every score is written to the journal before it gets delivered, and is
+    acknowledged once delivery succeeded. Failed deliveries are retried with
+    an exponential backoff, and the journal is replayed after a restart.
+    Only the location of pending scores is kept in memory, their replays
+    are read back from the journal when they get delivered.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        deliver: Callable[[dict, bytes], None],
+        max_size: int = 512 * 1024 ** 2,
+        max_backoff: float = 60
+    ) -> None:
+        self.path = path
+        self.deliver = deliver
+        self.max_size = max_size
+        self.max_backoff = max_backoff
+
+        self.pending: Dict[int, Location] = {}
+        self.size = 0
+        self.next_id = 0
+
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.stopped = Event()
+        self.logger = logging.getLogger("outbox")
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.load()
+        self.file = open(path, "ab")
+
+        self.thread = Thread(target=self.run, name="outbox", daemon=True)
+
+        depth.callback = lambda: {(): len(self.pending)}
+        depth_bytes.callback = lambda: {(): self.size}
+
+    def load(self) -> None:
+        """Restore every entry, that was not acknowledged before a restart"""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "rb") as f:
+            for offset, record_type, payload in read_journal(f):
+                if record_type == RECORD_ENTRY:
+                    entry_id, _ = decode_entry(payload)
+                    self.pending[entry_id] = (offset, len(payload))
+                    self.size += len(payload)
+                    self.next_id = max(self.next_id, entry_id + 1)
+
+                elif record_type == RECORD_ACK:
+                    entry_id, = struct.unpack("<Q", payload)
+
+                    if location := self.pending.pop(entry_id, None):
+                        self.size -= location[1]
+
+        if self.pending:
+            self.logger.info(f"Restored {len(self.pending)} pending score(s)")
+
+        # Drop acknowledged & corrupted records
+        self.compact()
+
+    def write(self, record_type: int, payload: bytes) -> int:
+        """Append a record to the journal, returning the offset of its payload"""
+        offset = self.file.tell() + HEADER.size
+        self.file.write(HEADER.pack(len(payload), zlib.crc32(payload), record_type))
+        self.file.write(payload)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return offset
+
+    def read(self, location: Location) -> Entry:
+        offset, length = location
+
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return decode_entry(f.read(length))[1]
+
+    def compact(self) -> None:
+        """Rewrite the journal, with only the pending entries"""
+        temp = f"{self.path}.tmp"
+        pending: Dict[int, Location] = {}
+
+        with open(self.path, "rb") as journal, open(temp, "wb") as f:
+            for entry_id, (offset, length) in self.pending.items():
+                journal.seek(offset)
+                payload = journal.read(length)
+
+                f.write(HEADER.pack(length, zlib.crc32(payload), RECORD_ENTRY))
+                pending[entry_id] = (f.tell(), length)
+                f.write(payload)
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp, self.path)
+        self.pending = pending
+
+    def put(self, metadata: dict, blob: bytes) -> bool:
+        """Write a score to the journal, returns `False` if the outbox is full"""
+        with self.lock:
+            entry_id = self.next_id
+            payload = encode_entry(entry_id, metadata, blob)
+
+            if self.size + len(payload) > self.max_size:
+                self.logger.warning("Outbox is full")
+                return False
+
+            self.next_id += 1
+            self.pending[entry_id] = (self.write(RECORD_ENTRY, payload), len(payload))
+            self.size += len(payload)
+
+        self.wakeup.set()
+        return True
+
+    def ack(self, entry_id: int) -> None:
+        with self.lock:
+            self.write(RECORD_ACK, struct.pack("<Q", entry_id))
+
+            if location := self.pending.pop(entry_id, None):
+                self.size -= location[1]
+
+            if self.file.tell() > 2 * self.max_size:
+                # Most of the journal was acknowledged, drop those records
+                self.file.close()
+                self.compact()
+                self.file = open(self.path, "ab")
+
+    def next(self) -> Optional[Tuple[int, Entry]]:
+        """Oldest pending entry, read back from the journal"""
+        with self.lock:
+            if not self.pending:
+                return None
+
+            entry_id, location = next(iter(self.pending.items()))
+            return entry_id, self.read(location)
+
+    def run(self) -> None:
+        backoff = 0.0
+
+        while not self.stopped.is_set():
+            if not (pending := self.next()):
+                self.wakeup.wait(1)
+                self.wakeup.clear()
+                continue
+
+            entry_id, (metadata, blob) = pending
+
+            try:
+                self.deliver(metadata, blob)
+            except Exception as e:
+                backoff = min(self.max_backoff, max(0.5, backoff * 2))
+                self.logger.warning(
+                    f"Failed to deliver score, retrying in {backoff:.1f}s: {e}"
+                )
+                self.stopped.wait(backoff)
+                continue
+
+            backoff = 0.0
+            self.ack(entry_id)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def shutdown(self, timeout: float = 10) -> None:
+        """Try to deliver every pending score, the rest is delivered after a restart"""
+        deadline = time.time() + timeout
+
+        while self.pending and time.time() < deadline:
+            time.sleep(0.1)
+
+        self.stopped.set()
+        self.wakeup.set()
+        self.thread.join()
+
+        if self.pending:
+            self.logger.warning(f"{len(self.pending)} score(s) are still pending")
+
+        self.file.close()
@@ -0,0 +1,150 @@
+from typing import Callable, Counter as CounterType, Dict, List, Optional, Tuple
+from collections import Counter
+from functools import wraps
+from threading import Lock, Thread, enumerate as enumerate_threads, get_ident
+
+import logging
+import metrics
+import time
+import sys
+import os
+
+handler_calls = metrics.registry.counter(
+    "spectator_handler_calls_total",
+    "Calls of packet handlers and game tasks",
+    ["handler"]
+)
+handler_seconds = metrics.registry.counter(
+    "spectator_handler_seconds_total",
+    "Time spent inside packet handlers and game tasks",
+    ["handler"]
+)
+
+class HandlerTimings:
+    """Call counts & cumulative time of every packet handler and game task"""
+
+    def __init__(self, threshold: float = 0.1) -> None:
+        self.threshold = threshold
+        self.calls: Dict[str, int] = {}
+        self.total: Dict[str, float] = {}
+        self.lock = Lock()
+        self.logger = logging.getLogger("timings")
+
+    def timed(self, function: Callable, name: Optional[str] = None) -> Callable:
+        """Wrap a handler, to record how long each call takes"""
+        name = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    def record(self, name: str, elapsed: float) -> None:
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.total[name] = self.total.get(name, 0.0) + elapsed
+
+        handler_calls.inc(handler=name)
+        handler_seconds.inc(elapsed, handler=name)
+
+        if elapsed > self.threshold:
+            self.logger.warning(f'Slow call to "{name}": {elapsed * 1000:.1f} ms')
+
+    def report(self) -> List[Tuple[str, int, float]]:
+        """Name, calls & cumulative time of every handler, slowest first"""
+        with self.lock:
+            return sorted(
+                ((name, self.calls[name], self.total[name]) for name in self.calls),
+                key=lambda entry: entry[2],
+                reverse=True
+            )
+
+    def log(self, count: int = 5) -> None:
+        """Log the handlers, that took the most time so far"""
+        handlers = ", ".join(
+            f"{name} ({calls} calls, {total:.2f}s)"
+            for name, calls, total in self.report()[:count]
+        )
+
+        if handlers:
+            self.logger.info(f"Slowest handlers: {handlers}")
+
+class Sampler:
+    """Statistical profiler, that samples the stacks of every thread
+
+    Unlike cProfile, this also covers the game threads of every slot.
+    The result is written in the collapsed stack format, that is
+    understood by most flamegraph tools.
+    """
+
+    def __init__(self, directory: str = "profiles", interval: float = 0.005) -> None:
+        self.directory = directory
+        self.interval = interval
+        self.thread: Optional[Thread] = None
+        self.logger = logging.getLogger("profiler")
+
+    @property
+    def running(self) -> bool:
+        return bool(self.thread and self.thread.is_alive())
+
+    def start(self, seconds: float) -> bool:
+        """Sample for `seconds` in a background thread"""
+        if self.running:
+            self.logger.warning("Profiler is already running")
+            return False
+
+        self.thread = Thread(
+            target=self.run,
+            args=(seconds,),
+            name="profiler",
+            daemon=True
+        )
+        self.thread.start()
+        return True
+
+    def sample(self, stacks: CounterType[str]) -> None:
+        names = {thread.ident: thread.name for thread in enumerate_threads()}
+        current = get_ident()
+
+        for ident, frame in sys._current_frames().items():
+            if ident == current:
+                continue
+
+            entries = []
+
+            while frame:
+                code = frame.f_code
+                entries.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+
+            stack = ";".join(reversed(entries))
+            stacks[f"{names.get(ident, ident)};{stack}"] += 1
+
+    def run(self, seconds: float) -> None:
+        self.logger.info(f"Profiling for {seconds} seconds...")
+        stacks: CounterType[str] = Counter()
+        samples = 0
+        end = time.time() + seconds
+
+        while time.time() < end:
+            self.sample(stacks)
+            samples += 1
+            time.sleep(self.interval)
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"profile-{int(time.time())}.txt")
+
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        self.logger.info(f"Wrote {samples} samples to {path}")
+
+timings = HandlerTimings()
+sampler = Sampler()
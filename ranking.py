@@ -0,0 +1,67 @@
+from typing import Dict, Iterator, List, Set, Tuple
+from osu.bancho.constants import StatusAction
+from osu.objects import Player
+
+import bisect
+
+class RankIndex:
+    """Spectatable players, kept in order of their rank
+
+    Only players that are ranked below `max_rank` and
+    are not afk are stored, which keeps the index small.
+    """
+
+    def __init__(self, max_rank: int = 250) -> None:
+        self.max_rank = max_rank
+        self.entries: List[Tuple[int, int]] = []
+        self.players: Dict[int, Player] = {}
+        self.ranks: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, player_id: int) -> bool:
+        return player_id in self.ranks
+
+    def eligible(self, player: Player) -> bool:
+        return (
+            0 < player.rank < self.max_rank and
+            player.status.action != StatusAction.Afk
+        )
+
+    def update(self, player: Player) -> None:
+        """Insert, move or remove a player after their stats have changed"""
+        if not self.eligible(player):
+            self.remove(player.id)
+            return
+
+        if self.ranks.get(player.id) == player.rank:
+            self.players[player.id] = player
+            return
+
+        self.remove(player.id)
+        bisect.insort(self.entries, (player.rank, player.id))
+        self.players[player.id] = player
+        self.ranks[player.id] = player.rank
+
+    def remove(self, player_id: int) -> None:
+        if (rank := self.ranks.pop(player_id, None)) is None:
+            return
+
+        index = bisect.bisect_left(self.entries, (rank, player_id))
+        del self.entries[index]
+        del self.players[player_id]
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.players.clear()
+        self.ranks.clear()
+
+    def candidates(self, exclude: Set[int] = frozenset()) -> Iterator[Player]:
+        """Iterate over players from the highest rank, skipping excluded ids"""
+        for _, player_id in self.entries:
+            if player_id in exclude:
+                continue
+
+            if player := self.players.get(player_id):
+                yield player
@@ -1,6 +1,7 @@
 
-from typing import Optional, Tuple, List
+from typing import TYPE_CHECKING, BinaryIO, Callable, Optional, List, Tuple
 from datetime import datetime, timezone
+from dataclasses import dataclass
 from copy import copy
 
 from osu.objects import ReplayFrame, ScoreFrame
@@ -9,76 +10,67 @@ from osu.bancho.streams import StreamOut
 from osu.objects import Player, Status
 from osu import Game
 
+from scheduler import StatsScheduler, SPECTATING
+from frames import FrameBuffer, ScoreFrameBuffer
 from objects import Score
 
+if TYPE_CHECKING:
+    from finalizer import ReplayFinalizer
+
+import tempfile
 import logging
+import metrics
 import lzma
+import time
+
+@dataclass(frozen=True)
+class ReplaySnapshot:
+    """Finished replay, detached from the live buffers so it can be finalized off-thread"""
+    score: Score
+    compressor: "lzma.LZMACompressor"
+    compressed: bytes
+    seed_frame: str
+    version: int
+    ticks: int
+    spill_file: Optional[BinaryIO] = None
 
-class Replay:
-    def __init__(self, manager) -> None:
-        self.game: Game = manager.game
-        self.manager = manager
-
-        self.score_frames: List[ScoreFrame] = []
-        self.frames: List[ReplayFrame] = []
-        self.seed = 0
-
-        self.completed = False
-        self.passed = False
-
-        self.logger = logging.getLogger("replay-manager")
-
-    @property
-    def player(self) -> Optional[Player]:
-        return self.manager.spectating
+    def replay_compressed(self) -> bytes:
+        """Flush the frame stream (only call this once)"""
+        with metrics.compression_seconds.time():
+            compressed = (
+                self.compressed +
+                self.compressor.compress(self.seed_frame.encode()) +
+                self.compressor.flush()
+            )
 
-    @property
-    def ticks(self) -> int:
-        return int(
-            (
-                datetime.now(timezone.utc) - datetime(1, 1, 1, tzinfo=timezone.utc)
-            ).total_seconds() * 10_000_000
-        )
+        stream = StreamOut()
 
-    @property
-    def replay_string(self) -> str:
-        previous_frame = ReplayFrame([], 0, 0.0, 0.0)
-        frames = []
-
-        for frame in self.frames:
-            frames.append(
-                "|".join(
-                    [
-                        str(frame.time - previous_frame.time),
-                        str(frame.x),
-                        str(frame.y),
-                        str(frame.button_state.value),
-                    ]
-                )
-            )
-            previous_frame = frame
+        if not self.spill_file:
+            stream.s32(len(compressed))
+            stream.write(compressed)
+            return stream.get()
 
-        # Append "seed"
-        frames.append(f"-12345|0|0|{self.seed}")
+        # Start of the stream was spilled to disk
+        spilled = self.spill_file.seek(0, 2)
+        stream.s32(spilled + len(compressed))
+        self.spill_file.seek(0)
 
-        return ",".join(frames)
+        while chunk := self.spill_file.read(1024 ** 2):
+            stream.write(chunk)
 
-    @property
-    def replay_compressed(self) -> bytes:
-        compressed = lzma.compress(self.replay_string.encode(), lzma.FORMAT_ALONE)
-        stream = StreamOut()
-        stream.s32(len(compressed))
+        self.spill_file.close()
         stream.write(compressed)
         return stream.get()
 
-    def create_osr(self, score: Score) -> bytes:
+    def create_osr(self) -> bytes:
         replay = StreamOut()
 
-        frame = score.frames[-1]
+        score = self.score
+        frame = score.data
 
         header = StreamOut()
         header.u8(score.status.mode.value)
-        header.s32(round(self.game.version_number))
+        header.s32(self.version)
         header.string(score.status.checksum)
         header.string(score.player.name)
         header.string(score.checksum)
@@ -96,59 +88,218 @@ class Replay:
         header.s64(self.ticks)
 
         replay.write(header.get())
-        replay.write(self.replay_compressed)
+        replay.write(self.replay_compressed())
         replay.s64(0) # score_id
 
         return replay.get()
 
-    def create(self) -> Optional[Tuple[Score, bytes]]:
+    def finalize(self) -> bytes:
+        """Build the replay file and submit the score"""
+        with metrics.finalize_seconds.time():
+            replay_file = self.create_osr()
+            self.score.submit(replay_file)
+
+        metrics.replays_created.inc()
+        return replay_file
+
+class Replay:
+    def __init__(self, manager) -> None:
+        self.game: Game = manager.game
+        self.manager = manager
+
+        self.score_frames = ScoreFrameBuffer()
+        self.frames = FrameBuffer()
+        self.seed = 0
+
+        # Frames are compressed as they arrive, so that finalizing a replay
+        # only needs to flush the stream. The compressor is created with the
+        # first frames, as setting up its dictionary is expensive.
+        self.compressor: Optional[lzma.LZMACompressor] = None
+        self.compressed = bytearray()
+
+        # Compressed stream, that exceeded the memory limit
+        self.spill_file: Optional[BinaryIO] = None
+        self.spilled_bytes = 0
+        self.last_frame = time.monotonic()
+
+        self.completed = False
+        self.passed = False
+
+        # Set when the replay stopped receiving frames in the middle of a play
+        self.expired = False
+
+        self.logger = logging.getLogger("replay-manager")
+
+    @property
+    def player(self) -> Optional[Player]:
+        return self.manager.spectating
+
+    @property
+    def ticks(self) -> int:
+        return int(
+            (
+                self.manager.clock() - datetime(1, 1, 1, tzinfo=timezone.utc)
+            ).total_seconds() * 10_000_000
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Amount of bytes kept in memory
+
+        This leaves out the state of the compressor, which does not depend
+        on the length of the replay, and can take up to 94 MiB at preset 6.
+        """
+        return self.score_frames.nbytes + len(self.compressed)
+
+    @property
+    def spilled(self) -> int:
+        """Amount of bytes spilled to disk"""
+        return self.spilled_bytes
+
+    @property
+    def idle_time(self) -> float:
+        """Seconds since frames were last received"""
+        return time.monotonic() - self.last_frame
+
+    @property
+    def seed_frame(self) -> str:
+        seed = f"-12345|0|0|{self.seed}"
+        return f",{seed}" if self.frames else seed
+
+    def add_frames(self, frames: List[ReplayFrame]) -> None:
+        """Add frames to the replay, and feed them into the compressor"""
+        if not frames:
+            return
+
+        separator = "," if self.frames else ""
+        data = separator + self.frames.encode(frames)
+
+        if not self.compressor:
+            self.compressor = lzma.LZMACompressor(lzma.FORMAT_ALONE)
+
+        self.compressed.extend(self.compressor.compress(data.encode()))
+        self.last_frame = time.monotonic()
+
+        if self.manager.memory_limit and len(self.compressed) > self.manager.memory_limit:
+            self.spill()
+
+    def spill(self) -> None:
+        """Move the compressed stream out of memory"""
+        if not self.spill_file:
+            self.spill_file = tempfile.TemporaryFile(
+                prefix="replay-",
+                dir=self.manager.spill_directory
+            )
+
+        self.spill_file.write(self.compressed)
+        self.spilled_bytes += len(self.compressed)
+        self.compressed = bytearray()
+
+        self.logger.info(
+            f"Replay exceeded memory limit, spilled {self.spilled / 1024:.1f} KiB to disk"
+        )
+
+    def snapshot(self, score: Score) -> ReplaySnapshot:
+        """Hand the current frame stream over to a snapshot"""
+        return ReplaySnapshot(
+            score=score,
+            compressor=self.compressor or lzma.LZMACompressor(lzma.FORMAT_ALONE),
+            compressed=bytes(self.compressed),
+            seed_frame=self.seed_frame,
+            version=round(self.game.version_number),
+            ticks=self.ticks,
+            spill_file=self.spill_file
+        )
+
+    def create(self) -> Optional[ReplaySnapshot]:
         self.logger.info("Creating replay...")
 
         if len(self.frames) <= 250:
             self.logger.warning(
                 f"Replay save failed: Replay too short ({len(self.frames)})"
             )
+            metrics.replays_rejected.inc(reason="too_short")
             self.reset()
             return
 
         if not self.score_frames:
             self.logger.warning("Replay save failed: No score frames found")
+            metrics.replays_rejected.inc(reason="no_score_frames")
             self.reset()
             return
 
-        if self.score_frames[-1].total_hits <= 0:
+        if self.score_frames.last.total_hits <= 0:
             self.logger.warning("Replay save failed: Total hits <= 0")
+            metrics.replays_rejected.inc(reason="no_hits")
             self.reset()
             return
 
         if not self.manager.current_status.checksum:
             self.logger.warning("Replay save failed: Missing status")
+            metrics.replays_rejected.inc(reason="missing_status")
             self.reset()
             return
 
         score = Score(
             self.score_frames,
-            self.player,
+            copy(self.player),
             self.manager.current_status,
-            self.passed
+            self.passed,
+            self.game.server,
+            self.manager.hp_graph
         )
 
-        replay_file = self.create_osr(score)
-        score.submit(replay_file)
+        snapshot = self.snapshot(score)
 
-        self.logger.info(f"Replay was submitted.")
+        # Spill file is owned by the snapshot now
+        self.spill_file = None
         self.reset()
 
-        return score, replay_file
+        if not self.manager.finalizer:
+            snapshot.finalize()
+            self.logger.info(f"Replay was submitted.")
+            return snapshot
+
+        self.manager.finalizer.submit(snapshot)
+        return snapshot
 
     def reset(self) -> None:
-        self.score_frames = []
-        self.frames = []
+        if self.spill_file:
+            self.spill_file.close()
+
+        self.score_frames = ScoreFrameBuffer()
+        self.frames = FrameBuffer()
         self.seed = 0
 
+        self.compressor = None
+        self.compressed = bytearray()
+
+        self.spill_file = None
+        self.spilled_bytes = 0
+        self.last_frame = time.monotonic()
+        self.expired = False
+
 class ReplayManager:
-    def __init__(self, game) -> None:
+    def __init__(
+        self,
+        game,
+        finalizer: Optional["ReplayFinalizer"] = None,
+        hp_graph: Tuple[str, int] = ("full", 0),
+        memory_limit: int = 0,
+        spill_directory: Optional[str] = None,
+        scheduler: Optional[StatsScheduler] = None
+    ) -> None:
         self.last_action = ReplayAction.SongSelect
+        self.finalizer = finalizer
+        self.scheduler = scheduler
+        self.hp_graph = hp_graph
+
+        # Compressed frames larger than this are spilled into temporary files
+        self.memory_limit = memory_limit
+        self.spill_directory = spill_directory
+
+        # Used to timestamp replays, can be replaced when playing back captures
+        self.clock: Callable[[], datetime] = lambda: datetime.now(timezone.utc)
         self.game: Game = game
 
         self.current_status = Status()
@@ -159,6 +310,31 @@ class ReplayManager:
     def spectating(self) -> Optional[Player]:
         return self.game.bancho.spectating
 
+    def request_stats(self) -> None:
+        """Request stats of the spectated player, batched if there is a scheduler"""
+        if not self.scheduler:
+            self.game.bancho.request_stats([self.spectating.id])
+            return
+
+        self.scheduler.request(self.spectating.id, SPECTATING)
+
+    def expire(self, timeout: float) -> None:
+        """Finish a replay, that did not receive any frames for `timeout` seconds"""
+        if not self.replay.frames or self.replay.idle_time < timeout:
+            return
+
+        self.logger.warning(
+            f"No frames received for {self.replay.idle_time:.0f}s, finishing replay..."
+        )
+
+        if not self.replay.completed:
+            self.replay.passed = False
+            self.replay.create()
+
+        self.replay.reset()
+        self.replay.completed = True
+        self.replay.expired = True
+
     def handle_frames(
         self,
         frames: List[ReplayFrame],
@@ -170,6 +346,14 @@ class ReplayManager:
             self.logger.warning("No target was found for spectating!")
             return
 
+        if self.replay.expired:
+            if action not in (ReplayAction.NewSong, ReplayAction.SongSelect):
+                # The rest of an expired play is missing its start, so it gets dropped
+                self.last_action = action
+                return
+
+            self.replay.expired = False
+
         if action == ReplayAction.Standard:
             self.replay.seed = extra
 
@@ -181,7 +365,7 @@ class ReplayManager:
             self.replay.reset()
             self.replay.completed = False
 
-            self.game.bancho.request_stats([self.spectating.id])
+            self.request_stats()
             self.logger.info(
                 f"{self.spectating} selected new song: {self.spectating.status.text} (https://osu.ppy.sh/b/{self.spectating.status.beatmap_id})."
             )
@@ -191,12 +375,12 @@ class ReplayManager:
                 self.current_status = copy(self.spectating.status)
 
         elif action == ReplayAction.Skip:
-            self.game.bancho.request_stats([self.spectating.id])
+            self.request_stats()
             self.logger.info(f"{self.spectating} skipped.")
 
         elif action == ReplayAction.Completion:
             if self.last_action != action:
-                self.game.bancho.request_stats([self.spectating.id])
+                self.request_stats()
                 self.logger.info(f"{self.spectating} passed.")
                 self.replay.passed = True
                 self.replay.completed = True
@@ -204,18 +388,18 @@ class ReplayManager:
 
         elif action == ReplayAction.Fail:
             if self.last_action != action:
-                self.game.bancho.request_stats([self.spectating.id])
+                self.request_stats()
                 self.logger.info(f"{self.spectating} failed.")
                 self.replay.completed = True
                 self.replay.create()
 
         elif action == ReplayAction.Pause:
             self.logger.info(f"{self.spectating} paused.")
-            self.game.bancho.request_stats([self.spectating.id])
+            self.request_stats()
 
         elif action == ReplayAction.Unpause:
             self.logger.info(f"{self.spectating} unpaused.")
-            self.game.bancho.request_stats([self.spectating.id])
+            self.request_stats()
 
         elif action == ReplayAction.SongSelect:
             self.logger.info(f"{self.spectating} is selecting new song...")
@@ -225,7 +409,7 @@ class ReplayManager:
                 self.replay.create()
 
         elif action == ReplayAction.WatchingOther:
-            self.game.bancho.request_stats([self.spectating.id])
+            self.request_stats()
             self.logger.warning(
                 f"{self.spectating} is currently spectating another player."
             )
@@ -235,7 +419,7 @@ class ReplayManager:
             # Current status has no valid beatmap
             self.current_status = copy(self.spectating.status)
 
-        self.replay.frames.extend(frames)
+        self.replay.add_frames(frames)
 
         if score_frame:
             self.replay.score_frames.append(score_frame)
@@ -0,0 +1,113 @@
+from typing import Dict, Iterable, List, Optional
+from threading import Lock
+
+import metrics
+import time
+
+SPECTATING = 0
+API = 1
+REFRESH = 2
+
+requested = metrics.registry.counter(
+    "spectator_stats_requests_total",
+    "Players whose stats were requested",
+    ["priority"]
+)
+deduplicated = metrics.registry.counter(
+    "spectator_stats_requests_deduplicated_total",
+    "Stats requests for players, that were already pending"
+)
+batches = metrics.registry.counter(
+    "spectator_stats_request_batches_total",
+    "Batched stats requests sent to bancho"
+)
+
+PRIORITIES = {SPECTATING: "spectating", API: "api", REFRESH: "refresh"}
+
+class StatsScheduler:
+    """Collects stats requests of a slot, and sends them to bancho in batches
+
+    Requests are deduplicated until the next batch goes out, which contains
+    the spectated player first, then players requested by the api, and then
+    a background refresh of the highest ranked players. At most `rate`
+    batches are sent per second.
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        batch_size: int = 32,
+        refresh_count: int = 16,
+        refresh_interval: float = 60
+    ) -> None:
+        self.rate = rate
+        self.batch_size = batch_size
+        self.refresh_count = refresh_count
+        self.refresh_interval = refresh_interval
+
+        self.pending: Dict[int, int] = {}
+        self.lock = Lock()
+
+        self.tokens = 1.0
+        self.last_update = time.monotonic()
+        self.last_refresh = 0.0
+
+        self.requests = 0
+        self.batches = 0
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    @property
+    def saved(self) -> int:
+        """Amount of bancho requests, that were avoided by batching"""
+        return self.requests - self.batches
+
+    def request(self, player_id: int, priority: int = API) -> None:
+        with self.lock:
+            self.requests += 1
+            requested.inc(priority=PRIORITIES[priority])
+
+            if player_id in self.pending:
+                deduplicated.inc()
+                self.pending[player_id] = min(priority, self.pending[player_id])
+                return
+
+            self.pending[player_id] = priority
+
+    def refresh(self, player_ids: Iterable[int]) -> None:
+        """Queue a refresh of the first `refresh_count` players, once per interval"""
+        if not self.refresh_count:
+            return
+
+        if time.monotonic() - self.last_refresh < self.refresh_interval:
+            return
+
+        self.last_refresh = time.monotonic()
+
+        for index, player_id in enumerate(player_ids):
+            if index >= self.refresh_count:
+                break
+
+            self.request(player_id, REFRESH)
+
+    def next_batch(self) -> Optional[List[int]]:
+        """Take the next batch of players, if the rate limit allows it"""
+        now = time.monotonic()
+        self.tokens = min(1.0, self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+
+        if self.tokens < 1 or not self.pending:
+            return None
+
+        with self.lock:
+            player_ids = sorted(self.pending, key=self.pending.__getitem__)[:self.batch_size]
+
+            for player_id in player_ids:
+                del self.pending[player_id]
+
+            self.batches += 1
+
+        self.tokens -= 1
+        batches.inc()
+        return player_ids
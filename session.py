@@ -2,18 +2,36 @@
 from typing import TYPE_CHECKING, Optional
 
 if TYPE_CHECKING:
-    from replays import ReplayManager
+    from finalizer import ReplayFinalizer
+    from checkpoint import Checkpoints
+    from executor import RedisExecutor
     from events import EventQueue
+    from leases import Leases
+    from shards import Shards
+    from storage import ReplayStorage
+    from outbox import Outbox
+    from stats import StatsWriter
+    from slots import Slots
     from redis import Redis
-    from osu import Game
 
 import logging
+import time
+
+# Replaced by main.py, with the time before anything was imported
+started: float = time.time()
 
 config: Optional[dict] = None
-game: Optional["Game"] = None
 redis: Optional["Redis"] = None
+executor: Optional["RedisExecutor"] = None
 queue: Optional["EventQueue"] = None
 api_queue: Optional["EventQueue"] = None
-manager: Optional["ReplayManager"] = None
+slots: Optional["Slots"] = None
+leases: Optional["Leases"] = None
+shards: Optional["Shards"] = None
+checkpoints: Optional["Checkpoints"] = None
+stats: Optional["StatsWriter"] = None
+finalizer: Optional["ReplayFinalizer"] = None
+storage: Optional["ReplayStorage"] = None
+outbox: Optional["Outbox"] = None
 
 logger = logging.getLogger("spectator")
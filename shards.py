@@ -0,0 +1,120 @@
+from typing import Dict, Iterable, Iterator, List, TypeVar
+from threading import Event, Thread
+from redis import Redis
+
+import hashlib
+import logging
+import socket
+import math
+import time
+import os
+
+T = TypeVar("T")
+
+class Shards:
+    """Splits spectating candidates between every running instance
+
+    Instances announce themselves with a heartbeat, and every player is
+    assigned to one of them by rendezvous hashing, weighted by the amount
+    of slots of each instance. When an instance joins or stops sending
+    heartbeats, only the players of that instance move to another one.
+    """
+
+    def __init__(
+        self,
+        connection: Redis,
+        slots: int = 1,
+        instance: str = "",
+        ttl: float = 30,
+        interval: float = 10
+    ) -> None:
+        self.redis = connection
+        self.slots = slots
+        self.instance = instance or f"{socket.gethostname()}:{os.getpid()}"
+        self.ttl = ttl
+        self.interval = interval
+
+        self.key = "spectator:instances"
+        self.instances: Dict[str, int] = {self.instance: slots}
+
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, name="shards", daemon=True)
+        self.logger = logging.getLogger("shards")
+
+    def heartbeat(self) -> None:
+        """Announce this instance, and update the list of live instances"""
+        now = time.time()
+
+        pipeline = self.redis.pipeline()
+        pipeline.zadd(self.key, {self.instance: now + self.ttl})
+        pipeline.hset(f"{self.key}:slots", self.instance, self.slots)
+        pipeline.zremrangebyscore(self.key, "-inf", now)
+        pipeline.zrange(self.key, 0, -1)
+        pipeline.hgetall(f"{self.key}:slots")
+        *_, members, slots = pipeline.execute()
+
+        instances = {
+            member.decode(): int(slots.get(member, 1))
+            for member in members
+        }
+        instances.setdefault(self.instance, self.slots)
+
+        if instances.keys() != self.instances.keys():
+            self.logger.info(f"Rebalanced shards between {len(instances)} instance(s)")
+
+            # Remove slot counts of instances, that are gone
+            if gone := set(slots) - set(members):
+                self.redis.hdel(f"{self.key}:slots", *gone)
+
+        self.instances = instances
+
+    def owner(self, player_id: int) -> str:
+        """Instance, that the player is assigned to"""
+        return max(
+            self.instances,
+            key=lambda instance: self.score(instance, player_id)
+        )
+
+    def score(self, instance: str, player_id: int) -> float:
+        digest = hashlib.blake2b(f"{instance}:{player_id}".encode(), digest_size=8).digest()
+
+        # Uniform value between 0 and 1 (both exclusive)
+        hash = ((int.from_bytes(digest, "big") >> 11) + 0.5) / 2 ** 53
+        return -self.instances[instance] / math.log(hash)
+
+    def owns(self, player_id: int) -> bool:
+        return self.owner(player_id) == self.instance
+
+    def prefer(self, players: Iterable[T], key=lambda player: player.id) -> Iterator[T]:
+        """Yield players of this shard first, followed by every other player"""
+        others: List[T] = []
+
+        for player in players:
+            if self.owns(key(player)):
+                yield player
+            else:
+                others.append(player)
+
+        yield from others
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.heartbeat()
+            except Exception as e:
+                self.logger.error(f"Failed to send heartbeat: {e}")
+
+            self.stopped.wait(self.interval)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def shutdown(self) -> None:
+        """Leave the shards, so that other instances take over right away"""
+        self.stopped.set()
+        self.thread.join()
+
+        pipeline = self.redis.pipeline()
+        pipeline.zrem(self.key, self.instance)
+        pipeline.hdel(f"{self.key}:slots", self.instance)
+        pipeline.execute()
@@ -0,0 +1,262 @@
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Set, Tuple
+from threading import Thread
+from collections import deque
+
+from osu.objects import Player
+from osu import Game
+
+from scheduler import StatsScheduler
+from replays import ReplayManager
+from ranking import RankIndex
+
+if TYPE_CHECKING:
+    from finalizer import ReplayFinalizer
+    from capture import PacketRecorder
+
+import logging
+import session
+import socket
+import time
+
+class Slot:
+    """A single tournament client, that records one spectating target"""
+
+    def __init__(
+        self,
+        index: int,
+        game: Game,
+        finalizer: Optional["ReplayFinalizer"] = None,
+        max_rank: int = 250,
+        hp_graph: Tuple[str, int] = ("full", 0),
+        memory_limit: int = 0,
+        spill_directory: Optional[str] = None,
+        inactivity_timeout: float = 300,
+        scheduler: Optional[StatsScheduler] = None,
+        reconnect_delay: float = 5,
+        max_reconnect_delay: float = 300,
+        target_cooldown: float = 60,
+        worker_id: str = "",
+        resume_timeout: float = 10
+    ) -> None:
+        self.index = index
+        self.game = game
+        self.worker_id = worker_id or socket.gethostname()
+        self.scheduler = scheduler or StatsScheduler()
+        self.manager = ReplayManager(
+            game,
+            finalizer,
+            hp_graph,
+            memory_limit,
+            spill_directory,
+            self.scheduler
+        )
+        self.inactivity_timeout = inactivity_timeout
+        self.rankings = RankIndex(max_rank)
+        self.recorder: Optional["PacketRecorder"] = None
+        self.thread: Optional[Thread] = None
+
+        self.logger = logging.getLogger(f"spectator-{self.name}")
+
+        self.frames_received = 0
+        self.sample_frames = 0
+        self.sample_time = time.time()
+
+        self.idle_time = 0.0
+        self.idle_sample = time.time()
+        self.idle_history = deque([(self.idle_sample, 0.0)])
+
+        # Replaced by the checkpoint of a previous process, when it gets resumed
+        self.started = time.time()
+        self.first_frame: Optional[float] = None
+
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connect_attempts = 0
+        self.connected_since = 0.0
+        self.resume_pending = False
+        self.select_pending = False
+
+        # Checkpoint of a target, that waits for its presence to be resumed
+        self.checkpoint: Optional[dict] = None
+        self.resume_timeout = resume_timeout
+        self.resume_deadline = 0.0
+
+        # Players that were released recently, and when they were released
+        self.target_cooldown = target_cooldown
+        self.released: Dict[int, float] = {}
+
+        # Hook into the reconnect loop of bancho, to add a backoff
+        self.connect_bancho = self.game.bancho.connect
+        self.game.bancho.connect = self.connect
+
+    def __repr__(self) -> str:
+        return f"<Slot {self.name}>"
+
+    @property
+    def name(self) -> str:
+        return f"{self.server}:{self.index}"
+
+    @property
+    def owner(self) -> str:
+        """Identifies this slot when claiming spectating targets, also across restarts
+
+        Processes that share an account need a different worker id,
+        otherwise they would claim the same targets.
+        """
+        return f"{self.worker_id}:{self.game.username}:{self.name}"
+
+    @property
+    def server(self) -> str:
+        return self.game.server
+
+    @property
+    def primary(self) -> bool:
+        """The primary slot of each server keeps the shared player cache up to date"""
+        return self.index == 0
+
+    @property
+    def spectating(self) -> Optional[Player]:
+        return self.manager.spectating
+
+    @property
+    def memory(self) -> int:
+        """Amount of bytes used by the replay buffer"""
+        return self.manager.replay.nbytes
+
+    @property
+    def spilled(self) -> int:
+        """Amount of bytes of the replay buffer, that were spilled to disk"""
+        return self.manager.replay.spilled
+
+    @property
+    def startup_time(self) -> float:
+        """Seconds from the start of the process until the first frame"""
+        if not self.first_frame:
+            return 0.0
+
+        return self.first_frame - session.started
+
+    def frame_rate(self) -> float:
+        """Frames received per second, since the last call"""
+        now = time.time()
+        elapsed = now - self.sample_time
+        frames = self.frames_received - self.sample_frames
+
+        self.sample_time = now
+        self.sample_frames = self.frames_received
+
+        return frames / elapsed if elapsed > 0 else 0.0
+
+    def update_idle_time(self) -> None:
+        """Add the time since the last call, if there is no spectating target"""
+        now = time.time()
+
+        if not self.spectating:
+            self.idle_time += now - self.idle_sample
+
+        self.idle_sample = now
+        self.idle_history.append((now, self.idle_time))
+
+        # Keep the idle time of the last hour
+        while now - self.idle_history[0][0] > 3600:
+            self.idle_history.popleft()
+
+    @property
+    def idle_per_hour(self) -> float:
+        """Seconds without a spectating target per hour, measured over the last hour"""
+        since, idle_time = self.idle_history[0]
+        now, current_idle_time = self.idle_history[-1]
+
+        if now <= since:
+            return 0.0
+
+        return (current_idle_time - idle_time) / (now - since) * 3600
+
+    def release(self, player_id: int) -> None:
+        """Keep a released target from being selected again for a while"""
+        self.released[player_id] = time.time()
+
+    def cooldowns(self) -> Set[int]:
+        """Players that were released within the cooldown"""
+        now = time.time()
+        self.released = {
+            player_id: released
+            for player_id, released in self.released.items()
+            if now - released < self.target_cooldown
+        }
+        return set(self.released)
+
+    def connect(self) -> None:
+        """Connect to bancho, with an exponential backoff for reconnects"""
+        if self.connected_since:
+            # Bancho reset its state, including the spectating target
+            self.manager.replay.reset()
+
+            # Players that logged out while disconnected never sent a logout,
+            # the index is filled again with the stats of online players
+            self.rankings.clear()
+
+        # Delay before the next attempt, in case this one fails
+        self.game.bancho.retry_delay = min(
+            self.max_reconnect_delay,
+            self.reconnect_delay * 2 ** self.connect_attempts
+        )
+        self.connect_attempts += 1
+
+        self.connect_bancho()
+        self.connected_since = time.time()
+        self.resume_pending = True
+        self.checkpoint = None
+
+    def check_connection(self, stable_after: float = 60) -> None:
+        """Reset the backoff, once the connection was stable for a while"""
+        if not self.connect_attempts or not self.game.bancho.connected:
+            return
+
+        if time.time() - self.connected_since > stable_after:
+            self.connect_attempts = 0
+
+    def start(self) -> None:
+        self.thread = Thread(
+            target=self.game.run,
+            name=f"slot-{self.name}",
+            daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.game.bancho.exit()
+
+        if self.recorder:
+            self.recorder.close()
+
+class Slots:
+    """Every spectator slot of this process"""
+
+    def __init__(self) -> None:
+        self.slots: List[Slot] = []
+
+    def __iter__(self) -> Iterator[Slot]:
+        return iter(self.slots)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def add(self, slot: Slot) -> None:
+        self.slots.append(slot)
+
+    def by_server(self, server: str) -> List[Slot]:
+        return [slot for slot in self.slots if slot.server == server]
+
+    def by_player(self, server: str, player_id: int) -> Optional[Slot]:
+        """Get the slot that is currently spectating this player"""
+        for slot in self.by_server(server):
+            if slot.spectating and slot.spectating.id == player_id:
+                return slot
+        return None
+
+    def primary(self, server: str) -> Optional[Slot]:
+        return next(
+            (slot for slot in self.by_server(server) if slot.primary),
+            None
+        )
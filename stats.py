@@ -0,0 +1,195 @@
+from typing import Any, Dict, List, Set, Tuple
+from threading import Event, Lock, Thread
+from redis import Redis
+
+from events import EventQueue
+
+import logging
+import metrics
+import time
+
+Key = Tuple[str, int]
+
+# Changes to other fields, like the name, are written without an event
+EVENT_PREFIXES = ("stats.", "status.")
+
+skipped_updates = metrics.registry.counter(
+    "spectator_stats_skipped_total",
+    "Stats updates, that did not change anything"
+)
+written_fields = metrics.registry.counter(
+    "spectator_stats_fields_written_total",
+    "Player fields written to redis"
+)
+
+def flatten(stats: dict, prefix: str = "") -> Dict[str, Any]:
+    """Flatten nested stats into dotted hash fields, e.g. `stats.pp`"""
+    fields = {}
+
+    for name, value in stats.items():
+        if isinstance(value, dict):
+            fields.update(flatten(value, f"{prefix}{name}."))
+            continue
+
+        # Redis only accepts strings & numbers
+        if isinstance(value, bool):
+            value = int(value)
+        elif value is None:
+            value = ""
+
+        fields[f"{prefix}{name}"] = value
+
+    return fields
+
+class StatsWriter:
+    """Collects player stats, and writes them to redis in batches
+
+    Players are stored as redis hashes. A snapshot of every player is kept,
+    so that only fields that actually changed get written, and updates
+    without any changes are skipped entirely. Pending changes are written
+    every `interval` seconds, or once `size` players are pending.
+    """
+
+    def __init__(
+        self,
+        connection: Redis,
+        queue: EventQueue,
+        interval: float = 0.5,
+        size: int = 500,
+        report_interval: float = 60
+    ) -> None:
+        self.redis = connection
+        self.queue = queue
+        self.interval = interval
+        self.size = size
+        self.report_interval = report_interval
+
+        self.snapshots: Dict[Key, Dict[str, Any]] = {}
+        self.pending: Dict[Key, Dict[str, Any]] = {}
+        self.created: Set[Key] = set()
+        self.lock = Lock()
+        self.stopped = Event()
+        self.wakeup = Event()
+
+        self.updates = 0
+        self.skipped = 0
+
+        self.thread = Thread(target=self.run, name="stats-writer", daemon=True)
+        self.logger = logging.getLogger("stats")
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def update(self, server: str, player_id: int, stats: dict) -> None:
+        fields = flatten(stats)
+        key = (server, player_id)
+
+        with self.lock:
+            self.updates += 1
+
+            if (previous := self.snapshots.get(key)) is None:
+                changes = fields
+                self.created.add(key)
+            else:
+                changes = {
+                    name: value for name, value in fields.items()
+                    if previous.get(name) != value
+                }
+
+            if not changes:
+                self.skipped += 1
+                skipped_updates.inc()
+                return
+
+            self.snapshots[key] = fields
+            self.pending.setdefault(key, {}).update(changes)
+            full = len(self.pending) >= self.size
+
+        if full:
+            # Flush on the writer thread, so that packet handlers never wait on redis
+            self.wakeup.set()
+
+    def forget(self, server: str, player_id: int) -> None:
+        """Drop the snapshot of a player, that went offline"""
+        with self.lock:
+            self.snapshots.pop((server, player_id), None)
+
+    def flush(self) -> None:
+        """Write every pending change, and submit one event per server"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            created, self.created = self.created, set()
+
+        if not pending:
+            return
+
+        servers: Dict[str, List[int]] = {}
+        pipeline = self.redis.pipeline(transaction=False)
+
+        for (server, player_id), changes in pending.items():
+            key = f"players:{server}:{player_id}"
+
+            if (server, player_id) in created:
+                # Player was not written by this process yet, which
+                # also replaces players that were stored as json before
+                pipeline.delete(key)
+
+            pipeline.hset(key, mapping=changes)
+
+            if any(name.startswith(EVENT_PREFIXES) for name in changes):
+                servers.setdefault(server, []).append(player_id)
+
+        try:
+            pipeline.execute()
+        except Exception:
+            # Keep the changes for the next flush, newer changes take precedence
+            with self.lock:
+                for key, changes in pending.items():
+                    self.pending[key] = {**changes, **self.pending.get(key, {})}
+
+                self.created |= created & set(pending)
+            raise
+
+        written_fields.inc(sum(len(changes) for changes in pending.values()))
+
+        for server, player_ids in servers.items():
+            self.queue.submit(
+                "stats_update",
+                player_ids,
+                server
+            )
+
+        self.logger.debug(f"Wrote stats of {len(pending)} player(s)")
+
+    def report(self) -> None:
+        with self.lock:
+            updates, skipped = self.updates, self.skipped
+            self.updates = self.skipped = 0
+
+        if updates:
+            self.logger.info(
+                f"Received {updates} stats update(s), "
+                f"skipped {skipped} without changes ({skipped / updates:.0%})"
+            )
+
+    def run(self) -> None:
+        last_report = time.time()
+
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error(f"Failed to write stats: {e}", exc_info=e)
+
+            if time.time() - last_report > self.report_interval:
+                self.report()
+                last_report = time.time()
+
+    def shutdown(self) -> None:
+        self.stopped.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
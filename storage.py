@@ -0,0 +1,162 @@
+from typing import List, Optional, Tuple
+from threading import Lock
+from redis import Redis
+
+import logging
+import mmap
+import time
+import os
+
+class ReplayStorage:
+    """Stores replay files by their score checksum"""
+
+    def store(self, checksum: str, replay_file: bytes) -> None:
+        raise NotImplementedError
+
+    def load(self, checksum: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+class RedisStorage(ReplayStorage):
+    """Replay files are stored as plain redis values, which expire after `max_age`"""
+
+    def __init__(self, connection: Redis, max_age: int = 60 * 60 * 96) -> None:
+        self.redis = connection
+        self.max_age = max_age
+
+    def store(self, checksum: str, replay_file: bytes) -> None:
+        self.redis.set(
+            f'replays:{checksum}',
+            replay_file,
+            ex=self.max_age
+        )
+
+    def load(self, checksum: str) -> Optional[bytes]:
+        return self.redis.get(f'replays:{checksum}')
+
+class DiskStorage(ReplayStorage):
+    """Replay files are stored inside a directory, and indexed inside redis
+
+    Files are addressed by their checksum, so storing the same replay twice
+    will only write it once. The oldest files get evicted, once they
+    exceed `max_age` or the directory grows larger than `max_size`.
+    """
+
+    def __init__(
+        self,
+        connection: Redis,
+        directory: str,
+        max_size: int = 10 * 1024 ** 3,
+        max_age: int = 60 * 60 * 96,
+        evict_interval: int = 60 * 10
+    ) -> None:
+        self.redis = connection
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+
+        self.lock = Lock()
+        self.logger = logging.getLogger("replay-storage")
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.size = sum(size for _, _, size in self.files())
+        self.last_eviction = 0.0
+
+    def path(self, checksum: str) -> str:
+        return os.path.join(self.directory, checksum[:2], f"{checksum}.osr")
+
+    def files(self) -> List[Tuple[str, float, int]]:
+        """Path, modification time & size of every stored replay"""
+        files = []
+
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(".osr"):
+                    continue
+
+                path = os.path.join(root, filename)
+
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+                files.append((path, stat.st_mtime, stat.st_size))
+
+        return files
+
+    def store(self, checksum: str, replay_file: bytes) -> None:
+        path = self.path(checksum)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Write to a temporary file first, so readers never see partial files
+            temp = f"{path}.{os.getpid()}.tmp"
+
+            with open(temp, "wb") as f:
+                f.write(replay_file)
+
+            os.replace(temp, path)
+
+            with self.lock:
+                self.size += len(replay_file)
+        else:
+            # Replay was already stored, only refresh its age
+            os.utime(path)
+
+        pipeline = self.redis.pipeline()
+        pipeline.hset(
+            f'replays:{checksum}:index',
+            mapping={
+                "size": len(replay_file),
+                "path": path,
+                "created": int(time.time())
+            }
+        )
+        pipeline.expire(f'replays:{checksum}:index', self.max_age)
+        pipeline.execute()
+
+        if self.size > self.max_size or time.time() - self.last_eviction > self.evict_interval:
+            self.evict()
+
+    def load(self, checksum: str) -> Optional[mmap.mmap]:
+        """Memory-map the replay file, if it exists"""
+        try:
+            with open(self.path(checksum), "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def evict(self) -> None:
+        """Remove expired replays, and the oldest ones while the directory is too large"""
+        with self.lock:
+            self.last_eviction = time.time()
+
+            files = sorted(self.files(), key=lambda file: file[1])
+            size = sum(file_size for _, _, file_size in files)
+            expiry = time.time() - self.max_age
+            evicted = []
+
+            for path, modified, file_size in files:
+                if modified > expiry and size <= self.max_size:
+                    break
+
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+                size -= file_size
+                evicted.append(path)
+
+            self.size = size
+
+        if not evicted:
+            return
+
+        self.redis.delete(*[
+            f'replays:{os.path.basename(path).removesuffix(".osr")}:index'
+            for path in evicted
+        ])
+        self.logger.info(f"Evicted {len(evicted)} replay(s)")
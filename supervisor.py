@@ -0,0 +1,188 @@
+"""Launch and supervise multiple spectator instances
+
+Every line of the credentials file contains a username and password,
+separated by whitespace. Empty lines and lines starting with "#" are ignored.
+Any other arguments are passed on to every instance. With multiple workers,
+flags of resources that can't be shared get a value per worker, based on
+the index of the worker (see `PER_WORKER`).
+
+Usage:
+    python supervisor.py credentials.txt --workers 4 --slots 2 --server ppy.sh
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+from subprocess import Popen, TimeoutExpired
+
+import argparse
+import logging
+import signal
+import socket
+import time
+import sys
+import os
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] - <%(name)s> %(levelname)s: %(message)s"
+)
+
+logger = logging.getLogger("supervisor")
+
+# Flags of resources, that every worker needs its own copy of
+PER_WORKER: Dict[str, Callable[[str, int], str]] = {
+    "--worker-id": lambda value, index: f"{value}-{index}",
+    "--outbox": lambda value, index: f"{value}.{index}",
+    "--metrics-port": lambda value, index: str(int(value) + index),
+    "--capture-directory": lambda value, index: os.path.join(value, str(index)),
+    "--profile-directory": lambda value, index: os.path.join(value, str(index))
+}
+
+def worker_arguments(arguments: List[str], index: int) -> List[str]:
+    """Arguments of a single worker, with a value per worker for every flag in `PER_WORKER`"""
+    result = []
+    remaining = iter(arguments)
+
+    for argument in remaining:
+        flag, separator, value = argument.partition("=")
+
+        if flag not in PER_WORKER:
+            result.append(argument)
+            continue
+
+        if not separator:
+            value = next(remaining, "")
+
+        result += [flag, PER_WORKER[flag](value, index)]
+
+    if "--worker-id" not in result:
+        # Workers of the same host need to claim targets under a different name
+        result += ["--worker-id", PER_WORKER["--worker-id"](socket.gethostname(), index)]
+
+    return result
+
+def read_credentials(path: str) -> List[Tuple[str, str]]:
+    credentials = []
+
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+
+            if not line or line.startswith("#"):
+                continue
+
+            username, password = line.split(maxsplit=1)
+            credentials.append((username, password))
+
+    return credentials
+
+class Worker:
+    """A single spectator instance, that gets restarted when it exits"""
+
+    def __init__(self, username: str, password: str, arguments: List[str]) -> None:
+        self.username = username
+        self.password = password
+        self.arguments = arguments
+
+        self.process: Optional[Popen] = None
+        self.started = 0.0
+        self.restart_at = 0.0
+        self.backoff = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self.process and self.process.poll() is None)
+
+    def start(self) -> None:
+        main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        self.process = Popen(
+            [sys.executable, main, self.username, self.password, *self.arguments],
+            # Signals from the terminal are forwarded by the supervisor instead
+            start_new_session=True
+        )
+        self.started = time.time()
+        logger.info(f"Started worker for {self.username} (pid {self.process.pid})")
+
+    def check(self, max_backoff: float) -> None:
+        """Restart the worker with an exponential backoff, once it exited"""
+        if self.running:
+            return
+
+        if self.process:
+            code = self.process.returncode
+            self.process = None
+
+            # Reset the backoff, if the worker ran for a while
+            if time.time() - self.started > 60:
+                self.backoff = 0
+
+            self.backoff = min(max_backoff, max(1, self.backoff * 2))
+            self.restart_at = time.time() + self.backoff
+            logger.warning(
+                f"Worker for {self.username} exited with code {code}, "
+                f"restarting in {self.backoff:.0f}s"
+            )
+
+        if time.time() >= self.restart_at:
+            self.start()
+
+    def stop(self) -> None:
+        if self.running:
+            # Workers shut down gracefully on SIGINT
+            self.process.send_signal(signal.SIGINT)
+
+    def wait(self, timeout: float = 30) -> None:
+        if not self.process:
+            return
+
+        try:
+            self.process.wait(timeout)
+        except TimeoutExpired:
+            logger.warning(f"Worker for {self.username} did not stop in time")
+            self.process.kill()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="osu! spectator supervisor")
+    parser.add_argument('credentials', help='File with one "username password" per line')
+    parser.add_argument('--workers', type=int, default=None, help='Amount of workers (defaults to one per credential)')
+    parser.add_argument('--max-backoff', type=float, default=300, help='Maximum seconds to wait before restarting a worker')
+    args, arguments = parser.parse_known_args()
+
+    credentials = read_credentials(args.credentials)[:args.workers or None]
+    workers = [
+        Worker(
+            username,
+            password,
+            worker_arguments(arguments, index) if len(credentials) > 1 else arguments
+        )
+        for index, (username, password) in enumerate(credentials)
+    ]
+
+    if not workers:
+        logger.error("No credentials found")
+        exit(1)
+
+    stopped = False
+
+    def stop(*_) -> None:
+        nonlocal stopped
+        stopped = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not stopped:
+        for worker in workers:
+            worker.check(args.max_backoff)
+
+        time.sleep(1)
+
+    logger.info("Stopping workers...")
+
+    for worker in workers:
+        worker.stop()
+
+    for worker in workers:
+        worker.wait()
+
+if __name__ == "__main__":
+    main()
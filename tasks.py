@@ -1,177 +1,339 @@
 
-from osu.bancho.constants import ServerPackets, StatusAction
-from osu.objects import Player, Channel
-from typing import Union
+from osu.bancho.constants import ServerPackets, StatusAction, ReplayAction
+from osu.objects import Player, Channel, Status
+from typing import Callable, Union
+from functools import partial, update_wrapper
 from copy import copy
 
-import session
-import json
+from slots import Slot
 
-@session.game.events.register(ServerPackets.SPECTATE_FRAMES)
-def frames(action, frames, score_frame, extra):
-    session.manager.handle_frames(
+import scheduler
+import profiling
+import metrics
+import session
+import time
+
+# Players with this status do not send any frames
+UNAVAILABLE = (StatusAction.Afk, StatusAction.Watching)
+
+def release_target(slot: Slot, player: Player):
+    """Stop spectating a player, and select the next target right away"""
+    session.executor.submit(session.leases.release, slot.server, player.id, slot.owner)
+    slot.game.bancho.stop_spectating()
+    slot.manager.replay.reset()
+    slot.manager.current_status = Status()
+    slot.release(player.id)
+    slot.select_pending = True
+
+def frames(slot: Slot, action, frames, score_frame, extra):
+    slot.frames_received += len(frames)
+    metrics.frames.inc(len(frames), slot=slot.name)
+
+    if not slot.first_frame:
+        slot.first_frame = time.time()
+        slot.logger.info(
+            f"Received first frame {slot.startup_time:.2f}s after startup"
+        )
+
+    if slot.recorder and slot.spectating:
+        slot.recorder.record(slot.spectating, action, frames, score_frame, extra)
+
+    slot.manager.handle_frames(
         frames,
         action,
         extra,
         score_frame
     )
 
-@session.game.events.register(ServerPackets.SEND_MESSAGE)
-def on_message(sender: Player, message: str, target: Union[Player, Channel]):
+    if action == ReplayAction.WatchingOther and slot.spectating:
+        release_target(slot, slot.spectating)
+
+def on_message(slot: Slot, sender: Player, message: str, target: Union[Player, Channel]):
     if target.name != '#spectator':
         return
 
-    session.queue.submit(
+    if not slot.spectating:
+        return
+
+    session.executor.submit(
+        session.queue.submit,
         "message",
-        server=session.game.server,
+        server=slot.server,
         sender_id=sender.id,
         sender_name=sender.name,
         message=message,
-        target=session.manager.spectating.name
+        target=slot.spectating.name
     )
 
-@session.game.events.register(ServerPackets.USER_LOGOUT)
-def user_logout(player: Player):
-    session.redis.delete(f"stats:{player.id}")
-    session.redis.lrem(f"spectating:{session.game.server}", 1, player.id)
+def user_logout(slot: Slot, player: Player):
+    slot.rankings.remove(player.id)
+
+    if slot.primary:
+        session.executor.execute("delete", f"stats:{player.id}")
+        session.stats.forget(slot.server, player.id)
 
-    if not session.manager.spectating:
+    if not slot.spectating:
         return
 
-    if player == session.manager.spectating:
-        session.game.bancho.stop_spectating()
-        session.manager.replay.reset()
+    if player == slot.spectating:
+        release_target(slot, player)
 
-@session.game.events.register(ServerPackets.USER_STATS)
-def stats_update(player: Player):
+def stats_update(slot: Slot, player: Player):
     if not player:
         return
 
-    user_dict = {
-        "id": player.id,
-        "name": player.name,
-        "country": player.country,
-        "server": session.game.server,
-        "stats": {
-            "rscore": player.rscore,
-            "tscore": player.tscore,
-            "acc": player.acc,
-            "pp": player.pp,
-            "playcount": player.playcount,
-            "rank": player.rank,
-        },
-        "status": {
-            "action": player.status.action.value,
-            "text": player.status.text,
-            "checksum": player.status.checksum,
-            "mods": player.status.mods.value,
-            "mode": player.status.mode.value,
-            "beatmap_id": player.status.beatmap_id,
+    slot.rankings.update(player)
+
+    if slot.primary:
+        user_dict = {
+            "id": player.id,
+            "name": player.name,
+            "country": player.country,
+            "server": slot.server,
+            "stats": {
+                "rscore": player.rscore,
+                "tscore": player.tscore,
+                "acc": player.acc,
+                "pp": player.pp,
+                "playcount": player.playcount,
+                "rank": player.rank,
+            },
+            "status": {
+                "action": player.status.action.value,
+                "text": player.status.text,
+                "checksum": player.status.checksum,
+                "mods": player.status.mods.value,
+                "mode": player.status.mode.value,
+                "beatmap_id": player.status.beatmap_id,
+            }
         }
-    }
 
-    session.redis.set(
-        f"players:{session.game.server}:{player.id}",
-        json.dumps(user_dict)
-    )
-
-    session.queue.submit(
-        "stats_update",
-        player.id,
-        session.game.server
-    )
+        session.stats.update(
+            slot.server,
+            player.id,
+            user_dict
+        )
 
-    if not session.manager.spectating:
+    if not slot.spectating:
         return
 
-    if player != session.manager.spectating:
+    if player != slot.spectating:
         return
 
     if player.status.action == StatusAction.Afk:
-        session.logger.info(f"{player} is {player.status}")
-        session.game.bancho.stop_spectating()
-        session.redis.lrem(f"spectating:{session.game.server}", 1, player.id)
+        slot.logger.info(f"{player} is {player.status}")
+        release_target(slot, player)
         return
 
     if player.status.action in (StatusAction.Playing, StatusAction.Multiplaying):
-        session.manager.current_status = copy(player.status)
-
-@session.game.tasks.register()
-def subscribe():
-    """Start listening to the api pubsub channel"""
-    session.api_queue.channel.subscribe("api")
-    session.api_queue.logger.info('Listening to pubsub channel...')
+        slot.manager.current_status = copy(player.status)
 
 @session.api_queue.register("stats_request")
 def stats_request(server: str, player_id: int):
     """Got stats request from api queue"""
-    if server != session.game.server:
+    slot = (
+        session.slots.by_player(server, player_id) or
+        session.slots.primary(server)
+    )
+
+    if not slot:
         return
 
-    session.game.bancho.request_stats([player_id])
+    # Requests are sent from the game thread of the slot
+    slot.scheduler.request(player_id, scheduler.API)
+
+@session.api_queue.register("profile")
+def profile(seconds: float = 30):
+    """Sample every thread for some seconds, and write the stacks to disk"""
+    profiling.sampler.start(min(float(seconds), 600))
+
+def request_stats(slot: Slot):
+    """Send the next batch of stats requests"""
+    if slot.primary:
+        slot.scheduler.refresh(player.id for player in slot.rankings.candidates())
+
+    if player_ids := slot.scheduler.next_batch():
+        slot.game.bancho.request_stats(player_ids)
+
+def select_target(slot: Slot):
+    """Spectate the highest ranked player, that is available"""
+    # Get players with an active lease, or that were released recently
+    spectating = session.leases.claimed(slot.server) | slot.cooldowns()
+
+    # Get highest ranked player available, that we can claim
+    # Another worker could have claimed a player in the meantime
+    candidates = slot.rankings.candidates(exclude=spectating)
+
+    if session.shards:
+        # Players of this instance's shard come first
+        candidates = session.shards.prefer(candidates)
+
+    player = next(
+        (
+            p for p in candidates
+            if p.status.action not in UNAVAILABLE
+            and session.leases.claim(slot.server, p.id, slot.owner)
+        ),
+        None
+    )
 
-@session.game.tasks.register(seconds=1, loop=True)
-def event_listener():
-    if not (message := session.api_queue.channel.get_message()):
+    if not player:
         return
 
-    if message["data"] == 1:
+    slot.logger.info(f"Spectating {player}")
+
+    slot.game.bancho.start_spectating(player)
+    slot.logger.info(f"{player} is {player.status}")
+
+def retarget(slot: Slot):
+    """Select a new target right after losing the previous one"""
+    if not slot.select_pending:
         return
 
-    name, args, kwargs = eval(message["data"])
+    slot.select_pending = False
+
+    if not slot.spectating:
+        select_target(slot)
+
+def spectator_controller(slot: Slot):
+    """Select a player to spectate, and update their stats
 
-    if name not in session.api_queue.events:
+    Targets are usually selected by `retarget` as soon as they are lost,
+    so this only catches slots that are still without a target.
+    """
+    if not slot.spectating:
+        select_target(slot)
+
+    else:
+        # We are already spectating someone
+        if not slot.game.bancho.connected:
+            # The client disconnected from bancho, the lease is
+            # kept so that the target can be resumed after reconnecting
+            slot.game.bancho.spectating = None
+            slot.manager.replay.reset()
+            return
+
+        if not session.leases.renew(slot.server, slot.spectating.id, slot.owner):
+            # Lease ran out and was taken over by another worker
+            slot.logger.warning(f"Lost lease on {slot.spectating}")
+            slot.game.bancho.stop_spectating()
+            slot.manager.replay.reset()
+            slot.select_pending = True
+            return
+
+        slot.scheduler.request(slot.spectating.id, scheduler.SPECTATING)
+
+def resume_target(slot: Slot):
+    """Resume the target of a previous connection or process, right after logging in
+
+    The target is only resumed once it shows up in the presence list,
+    otherwise it is released after `resume_timeout` seconds.
+    """
+    if not slot.resume_pending:
         return
 
-    session.api_queue.logger.debug(
-        f'Got event for "{name}" with {args} and {kwargs}'
-    )
+    if slot.spectating or not session.checkpoints:
+        finish_resume(slot)
+        return
 
-    session.api_queue.events[name](*args, **kwargs)
-
-@session.game.tasks.register(seconds=10, loop=True)
-def spectator_controller():
-    """Select a player to spectate, and update their stats"""
-    if not session.manager.spectating:
-        # Get spectating list
-        spectating = {
-            int(id) for id in session.redis.lrange(
-                f"spectating:{session.game.server}", 0, -1
-            )
-        }
+    if not (checkpoint := slot.checkpoint):
+        checkpoint = session.checkpoints.load(slot)
 
-        # Get highest ranked player available
-        players = [
-            p for p in session.game.bancho.players
-            if (p.rank != 0 and p.rank < 250) and
-               (p.id not in spectating) and
-               (p.status.action != StatusAction.Afk)
-        ]
-        players.sort(key=lambda x: x.rank)
-        player = players[0]
+        if not checkpoint:
+            finish_resume(slot)
+            return
+
+        slot.started = min(slot.started, checkpoint["started"])
 
-        # Add player to spectating list
-        session.redis.lpush(f"spectating:{session.game.server}", player.id)
-        session.logger.info(f"Spectating {player}")
+        if not (target := checkpoint["target"]):
+            finish_resume(slot)
+            return
 
-        session.game.bancho.start_spectating(player)
-        session.logger.info(f"{player} is {player.status}")
+        if not session.leases.claim(slot.server, target["id"], slot.owner):
+            slot.logger.info(f"Previous target {target['name']} was taken over")
+            finish_resume(slot)
+            return
 
-        if player.status.action == StatusAction.Afk:
-            # Player is afk, choose another player
-            session.redis.lrem(f"spectating:{session.game.server}", 1, player.id)
-            session.game.bancho.stop_spectating()
+        slot.checkpoint = checkpoint
+        slot.resume_deadline = time.time() + slot.resume_timeout
 
-    else:
-        # We are already spectating someone
-        if not session.game.bancho.connected:
-            # The client disconnected from bancho
-            session.redis.lrem(
-                f"spectating:{session.game.server}", 1,
-                session.manager.spectating.id
-            )
-            session.game.bancho.spectating = None
-            session.manager.replay.reset()
+    target = checkpoint["target"]
+
+    if not (player := slot.game.bancho.players.by_id(target["id"])):
+        if time.time() < slot.resume_deadline:
+            # Presence of online players arrives shortly after logging in
             return
 
-        session.manager.spectating.request_stats()
+        slot.logger.info(f"Previous target {target['name']} is offline")
+        session.executor.submit(session.leases.release, slot.server, target["id"], slot.owner)
+        session.executor.submit(session.checkpoints.delete, session.checkpoints.key(slot))
+        finish_resume(slot)
+        return
+
+    slot.logger.info(f"Resuming {player}")
+    slot.manager.current_status = checkpoint["status"]
+    slot.game.bancho.start_spectating(player)
+    finish_resume(slot)
+
+def finish_resume(slot: Slot):
+    """Select a new target, unless the previous one was resumed"""
+    slot.resume_pending = False
+    slot.checkpoint = None
+    slot.select_pending = True
+
+def save_checkpoint(slot: Slot):
+    session.executor.submit(
+        session.checkpoints.save,
+        session.checkpoints.key(slot),
+        session.checkpoints.encode(slot)
+    )
+
+def check_connection(slot: Slot):
+    slot.check_connection()
+
+def expire_replay(slot: Slot):
+    """Finish replays, that stopped receiving frames"""
+    slot.manager.expire(slot.inactivity_timeout)
+
+def idle_time(slot: Slot):
+    slot.update_idle_time()
+
+def slot_statistics(slot: Slot):
+    """Log the throughput and memory usage of this slot"""
+    if slot.recorder:
+        slot.recorder.flush()
+
+    slot.logger.info(
+        f"{slot.frame_rate():.1f} frames/s, "
+        f"{slot.memory / 1024:.1f} KiB buffered, "
+        f"{slot.spilled / 1024:.1f} KiB spilled, "
+        f"{slot.idle_per_hour:.0f}s idle per hour, "
+        f"{slot.scheduler.saved} stats request(s) saved by batching"
+    )
+
+    if slot is next(iter(session.slots)):
+        # Timings are shared by every slot of this process
+        profiling.timings.log()
+
+def bind(function: Callable, slot: Slot) -> Callable:
+    """Bind a handler to a slot, keeping its name for logging & timings"""
+    return profiling.timings.timed(update_wrapper(partial(function, slot), function))
+
+def register(slot: Slot):
+    """Register every packet handler and task on the game of a slot"""
+    events = slot.game.events
+    events.register(ServerPackets.SPECTATE_FRAMES)(bind(frames, slot))
+    events.register(ServerPackets.SEND_MESSAGE)(bind(on_message, slot))
+    events.register(ServerPackets.USER_LOGOUT)(bind(user_logout, slot))
+    events.register(ServerPackets.USER_STATS)(bind(stats_update, slot))
+
+    tasks = slot.game.tasks
+    tasks.register(seconds=10, loop=True)(bind(spectator_controller, slot))
+    tasks.register(seconds=0.25, loop=True)(bind(resume_target, slot))
+    tasks.register(seconds=0.25, loop=True)(bind(retarget, slot))
+    tasks.register(seconds=5, loop=True)(bind(save_checkpoint, slot))
+    tasks.register(seconds=10, loop=True)(bind(check_connection, slot))
+    tasks.register(seconds=0.25, loop=True)(bind(request_stats, slot))
+    tasks.register(seconds=1, loop=True)(bind(idle_time, slot))
+    tasks.register(seconds=30, loop=True)(bind(expire_replay, slot))
+    tasks.register(minutes=1, loop=True)(bind(slot_statistics, slot))
@@ -0,0 +1,58 @@
+from osu.objects import Player
+
+from benchmarks.synthetic import generate_play
+from capture import PacketRecorder, MAGIC, play
+from fakes import FakeGame
+from osr import ReplayFile
+
+import pytest
+
+def graph_points(replay: ReplayFile) -> int:
+    return len(replay.hp_graph.split(","))
+
+def record(path: str, version: int, hp_graph: tuple) -> None:
+    player = Player(2, "peppy", FakeGame())
+    player.status.checksum = "da8aae79c8f3306b5d65ec951874a7fb"
+
+    recorder = PacketRecorder(path, version, hp_graph)
+
+    for action, frames, score_frame, extra in generate_play(1):
+        recorder.record(player, action, frames, score_frame, extra)
+
+    recorder.close()
+
+@pytest.mark.parametrize("version, hp_graph", [
+    (20240101, ("full", 0)),
+    (20250626.5, ("interval", 1000)),
+])
+def test_playback_uses_recorded_settings(tmp_path, version, hp_graph):
+    path = str(tmp_path / "ppy.sh-0.cap")
+    record(path, version, hp_graph)
+
+    (filename, data), = play(path)
+    replay = ReplayFile.decode(data)
+
+    assert replay.version == round(version)
+
+    # One point per second, instead of one per score frame
+    assert (graph_points(replay) < 100) == (hp_graph[0] == "interval")
+
+def test_legacy_capture(tmp_path):
+    path = str(tmp_path / "ppy.sh-0.cap")
+    record(path, 20250626, ("interval", 1000))
+
+    # Captures of the first version had no header
+    with open(path, "rb") as f:
+        data = f.read()
+
+    header_size = len(MAGIC) + 1
+    header_length = int.from_bytes(data[header_size:header_size + 4], "little")
+
+    with open(path, "wb") as f:
+        f.write(MAGIC + bytes([1]) + data[header_size + 4 + header_length:])
+
+    (filename, data), = play(path)
+    replay = ReplayFile.decode(data)
+
+    assert replay.version == 20240101
+    assert graph_points(replay) > 100
@@ -0,0 +1,124 @@
+from events import EventQueue, JsonCodec, MsgpackCodec, ReprCodec
+
+import pytest
+import time
+
+fakeredis = pytest.importorskip("fakeredis")
+
+EVENT = ("score", (2, "peppy"), {"server": "ppy.sh", "mods": [8, 64], "checksum": None})
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeRedis()
+
+def create_queue(redis, **kwargs) -> EventQueue:
+    return EventQueue("spectator", redis, consumer="worker-1", **kwargs)
+
+@pytest.mark.parametrize("codec", [JsonCodec, MsgpackCodec, ReprCodec])
+def test_codec_round_trip(redis, codec):
+    if codec is MsgpackCodec:
+        pytest.importorskip("msgpack")
+
+    queue = create_queue(redis, codec=codec())
+    name, args, kwargs = EVENT
+
+    assert queue.decode(queue.encode(name, *args, **kwargs)) == EVENT
+
+def test_decode_rejects_legacy_events(redis):
+    queue = create_queue(redis, legacy=False)
+
+    with pytest.raises(ValueError):
+        queue.decode(ReprCodec().encode(*EVENT))
+
+def test_decode_rejects_unknown_version(redis):
+    with pytest.raises(ValueError):
+        create_queue(redis).decode(b"\x7f[]")
+
+def test_drain_pubsub(redis):
+    queue = create_queue(redis, codec=JsonCodec())
+    queue.channel.subscribe(queue.name)
+
+    for index in range(5):
+        queue.submit("message", index)
+
+    assert [event for _, event in queue.drain(limit=3)] == [("message", (index,), {}) for index in range(3)]
+    assert [event for _, event in queue.drain()] == [("message", (index,), {}) for index in range(3, 5)]
+
+def test_drain_stream(redis):
+    queue = create_queue(redis, codec=JsonCodec(), transport="stream")
+    queue.create_group()
+
+    for index in range(5):
+        queue.submit("message", index)
+
+    messages = queue.drain(timeout=0)
+    assert [event for _, event in messages] == [("message", (index,), {}) for index in range(5)]
+    assert redis.xpending(queue.stream, queue.group)["pending"] == 5
+
+    queue.ack([message_id for message_id, _ in messages])
+    assert redis.xpending(queue.stream, queue.group)["pending"] == 0
+    assert queue.drain(timeout=0) == []
+
+def test_undecodable_entries_are_acknowledged(redis):
+    queue = create_queue(redis, transport="stream")
+    queue.create_group()
+    redis.xadd(queue.stream, {"data": b"\x7f[]"})
+    queue.submit("message", 1)
+
+    assert [event for _, event in queue.drain(timeout=0)] == [("message", (1,), {})]
+    assert redis.xpending(queue.stream, queue.group)["pending"] == 1
+
+def consume(queue: EventQueue, dispatched: int) -> None:
+    """Consume events in the background, until a number of events were dispatched"""
+    queue.start()
+    deadline = time.time() + 5
+
+    while queue.dispatched < dispatched and time.time() < deadline:
+        time.sleep(0.01)
+
+    queue.stop()
+
+def test_consume_leaves_failed_events_pending(redis):
+    queue = create_queue(redis, transport="stream")
+    received = []
+
+    @queue.register("message")
+    def message(index: int) -> None:
+        if index == 1:
+            raise RuntimeError("handler failed")
+
+        received.append(index)
+
+    for index in range(3):
+        queue.submit("message", index)
+
+    consume(queue, 3)
+    assert received == [0, 2]
+
+    pending = redis.xpending_range(queue.stream, queue.group, "-", "+", 10)
+    assert len(pending) == 1
+
+    # Other consumers take over the failed event
+    other = EventQueue("spectator", redis, consumer="worker-2", reclaim_after=0)
+    messages = other.reclaim()
+
+    assert [message_id for message_id, _ in messages] == [pending[0]["message_id"]]
+    assert messages[0][1] == ("message", (1,), {})
+
+def test_consume_continues_after_restart(redis):
+    queue = create_queue(redis, transport="stream")
+    queue.create_group()
+
+    for index in range(3):
+        queue.submit("message", index)
+
+    # Events were read, but the process stopped before acknowledging them
+    assert len(queue.drain(timeout=0)) == 3
+
+    restarted = create_queue(redis, transport="stream")
+    received = []
+    restarted.register("message")(received.append)
+
+    consume(restarted, 3)
+    assert received == [0, 1, 2]
+    assert redis.xpending(queue.stream, queue.group)["pending"] == 0
@@ -0,0 +1,109 @@
+from typing import List
+from osu.objects import ScoreFrame
+
+from benchmarks.synthetic import generate_play
+from frames import ScoreFrameBuffer
+
+import bisect
+import pytest
+
+def score_frame(time: int, hp: int) -> ScoreFrame:
+    return ScoreFrame(time, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, False, hp, 0)
+
+def create_buffer(points) -> ScoreFrameBuffer:
+    frames = ScoreFrameBuffer()
+
+    for time, hp in points:
+        frames.append(score_frame(time, hp))
+
+    return frames
+
+@pytest.fixture(scope="module")
+def long_play() -> ScoreFrameBuffer:
+    """Score frames of a 10 minute play"""
+    frames = ScoreFrameBuffer()
+
+    for _, _, frame, _ in generate_play(10):
+        if frame:
+            frames.append(frame)
+
+    return frames
+
+def mean_error(frames: ScoreFrameBuffer, indices: List[int]) -> float:
+    """Average hp difference between the full graph, and the interpolated downsampled graph"""
+    times = [frames.time[index] for index in indices]
+    values = [frames.hp[index] for index in indices]
+    error = 0.0
+
+    for time, hp in zip(frames.time, frames.hp):
+        index = bisect.bisect_right(times, time) - 1
+
+        if index >= len(times) - 1:
+            value = values[-1]
+        else:
+            progress = (time - times[index]) / max(1, times[index + 1] - times[index])
+            value = values[index] + (values[index + 1] - values[index]) * progress
+
+        error += abs(value - hp)
+
+    return error / len(frames)
+
+@pytest.mark.parametrize("mode, resolution", [("interval", 1000), ("lttb", 1000)])
+def test_downsampling_long_play(long_play, mode, resolution):
+    indices = (
+        long_play.interval_indices(resolution) if mode == "interval" else
+        long_play.lttb_indices(resolution)
+    )
+
+    assert indices == sorted(set(indices))
+    assert indices[0] == 0
+    assert indices[-1] == len(long_play) - 1
+
+    # At least 20 times smaller, while staying within 2.5% of the full graph
+    assert len(long_play.hp_graph(mode, resolution)) * 20 < len(long_play.hp_graph())
+    assert mean_error(long_play, indices) < 5
+
+def test_interval_keeps_last_frame_of_every_interval(long_play):
+    indices = set(long_play.interval_indices(1000))
+    time = long_play.time
+
+    for index in range(len(long_play) - 1):
+        if time[index] // 1000 != time[index + 1] // 1000:
+            assert index in indices
+
+def test_lttb_threshold(long_play):
+    assert len(long_play.lttb_indices(300)) == 300
+
+@pytest.mark.parametrize("resolution", [0, -1, 1000])
+def test_empty(resolution):
+    frames = ScoreFrameBuffer()
+
+    assert frames.interval_indices(resolution) == []
+    assert frames.lttb_indices(resolution) == []
+    assert frames.hp_graph("interval", resolution) == ""
+    assert frames.hp_graph("lttb", resolution) == ""
+
+@pytest.mark.parametrize("resolution", [0, -1000])
+def test_interval_without_resolution(resolution):
+    frames = create_buffer((time, 200) for time in range(0, 5000, 100))
+    assert frames.interval_indices(resolution) == list(range(len(frames)))
+
+@pytest.mark.parametrize("threshold", [0, -1, 2, 50, 51, 1000])
+def test_lttb_without_reduction(threshold):
+    frames = create_buffer((time, time % 200) for time in range(0, 5000, 100))
+    assert frames.lttb_indices(threshold) == list(range(len(frames)))
+
+@pytest.mark.parametrize("threshold", [3, 4, 10])
+def test_lttb_keeps_first_and_last(threshold):
+    frames = create_buffer((time, (time * 7) % 200) for time in range(0, 5000, 100))
+    indices = frames.lttb_indices(threshold)
+
+    assert len(indices) == threshold
+    assert indices[0] == 0
+    assert indices[-1] == len(frames) - 1
+
+def test_interval_single_frame():
+    frames = create_buffer([(500, 100)])
+
+    assert frames.interval_indices(1000) == [0]
+    assert frames.hp_graph("interval", 1000) == "500|0.5"
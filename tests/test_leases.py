@@ -0,0 +1,49 @@
+from leases import Leases
+
+import pytest
+import time
+
+fakeredis = pytest.importorskip("fakeredis")
+
+@pytest.fixture
+def leases() -> Leases:
+    return Leases(fakeredis.FakeRedis(), ttl=30)
+
+def test_claim(leases):
+    assert leases.claim("ppy.sh", 2, "worker-1")
+    assert leases.claimed("ppy.sh") == {2}
+    assert leases.claimed("example.com") == set()
+
+def test_claim_is_reentrant(leases):
+    assert leases.claim("ppy.sh", 2, "worker-1")
+    assert leases.claim("ppy.sh", 2, "worker-1")
+    assert leases.claimed("ppy.sh") == {2}
+
+def test_claim_rejects_other_owner(leases):
+    assert leases.claim("ppy.sh", 2, "worker-1")
+    assert not leases.claim("ppy.sh", 2, "worker-2")
+    assert not leases.renew("ppy.sh", 2, "worker-2")
+    assert leases.renew("ppy.sh", 2, "worker-1")
+
+def test_expiry(leases):
+    leases.ttl = 0.05
+    assert leases.claim("ppy.sh", 2, "worker-1")
+
+    time.sleep(0.1)
+    assert leases.claimed("ppy.sh") == set()
+    assert not leases.renew("ppy.sh", 2, "worker-1")
+
+    # Expired leases can be claimed by anyone
+    leases.ttl = 30
+    assert leases.claim("ppy.sh", 2, "worker-2")
+    assert not leases.release("ppy.sh", 2, "worker-1")
+    assert leases.claimed("ppy.sh") == {2}
+
+def test_release_only_by_owner(leases):
+    assert leases.claim("ppy.sh", 2, "worker-1")
+    assert not leases.release("ppy.sh", 2, "worker-2")
+    assert leases.claimed("ppy.sh") == {2}
+
+    assert leases.release("ppy.sh", 2, "worker-1")
+    assert leases.claimed("ppy.sh") == set()
+    assert leases.claim("ppy.sh", 2, "worker-2")
@@ -0,0 +1,119 @@
+from osu.bancho.streams import StreamIn, StreamOut
+from osu.objects import Player
+
+from benchmarks.synthetic import generate_play
+from fakes import FakeGame, SnapshotCollector, setup
+from replays import ReplayManager, ReplaySnapshot
+from osr import ReplayFile, stored_checksum, verify
+
+import pytest
+import lzma
+
+@pytest.fixture(scope="module")
+def snapshot() -> ReplaySnapshot:
+    """Snapshot of a synthetic play, that was passed
+
+    Its frame stream can only be flushed once, use the `data` fixture for the replay file.
+    """
+    setup()
+    game = FakeGame()
+
+    player = Player(2, "peppy", game)
+    player.status.checksum = "da8aae79c8f3306b5d65ec951874a7fb"
+    game.bancho.spectating = player
+
+    manager = ReplayManager(game, SnapshotCollector())
+    manager.current_status = player.status
+
+    for action, frames, score_frame, extra in generate_play(1, score_rate=1):
+        manager.handle_frames(frames, action, extra, score_frame)
+
+    snapshot, = manager.finalizer.snapshots
+    return snapshot
+
+@pytest.fixture(scope="module")
+def data(snapshot) -> bytes:
+    return snapshot.create_osr()
+
+def counts_offset(data: bytes) -> int:
+    """Position of the hit counts inside the header"""
+    stream = StreamIn(data)
+    stream.u8()
+    stream.s32()
+
+    for _ in range(3):
+        stream.string()
+
+    return stream.tell()
+
+def replace_frames(data: bytes, entries: str) -> bytes:
+    """Replace the frame stream of a replay file"""
+    replay = ReplayFile.decode(data)
+    header = data[:len(data) - len(replay.compressed) - 12]
+    compressed = lzma.compress(entries.encode(), format=lzma.FORMAT_ALONE)
+
+    stream = StreamOut()
+    stream.s32(len(compressed))
+    stream.write(compressed)
+    stream.s64(replay.score_id)
+    return header + stream.get()
+
+def test_decode(snapshot, data):
+    replay = ReplayFile.decode(data)
+
+    assert replay.checksum == snapshot.score.checksum
+    assert replay.player_name == "peppy"
+    assert replay.seed() is not None
+    assert sum(1 for _ in replay.frames()) > 250
+
+@pytest.mark.parametrize("name", [
+    "{checksum}",
+    "{checksum}.osr",
+    "replays:{checksum}",
+    "replays/replay-osu_{checksum}.osr",
+])
+def test_verify(snapshot, data, name):
+    name = name.format(checksum=snapshot.score.checksum)
+
+    assert stored_checksum(name) == snapshot.score.checksum
+    assert verify(name, data) == []
+
+@pytest.mark.parametrize("length, problem", [
+    (0, "Truncated header"),
+    (40, "Truncated header"),
+    (-100, "Truncated frame stream"),
+])
+def test_truncated(snapshot, data, length, problem):
+    problems = verify(snapshot.score.filename_safe, data[:length])
+
+    assert len(problems) == 1
+    assert problems[0].startswith(problem)
+
+def test_stored_checksum_mismatch(snapshot, data):
+    problems = verify("replay-osu_" + "0" * 32 + ".osr", data)
+    assert problems == [f"Checksum mismatch: stored as {'0' * 32}, but replay has {snapshot.score.checksum}"]
+
+def test_header_checksum_mismatch(snapshot, data):
+    checksum = snapshot.score.checksum
+    data = data.replace(checksum.encode(), b"0" * 32)
+
+    problems = verify("0" * 32, data)
+    assert problems == ["Checksum mismatch: does not match the score inside the header"]
+
+def test_frame_count_mismatch(snapshot, data):
+    # Keep the first 100 frames, and the seed frame at the end
+    entries = list(ReplayFile.decode(data).entries())
+    entries = entries[:100] + entries[-1:]
+    problems = verify(snapshot.score.filename_safe, replace_frames(data, ",".join(entries)))
+
+    assert len(problems) == 2
+    assert problems[0] == "Too few frames: 100"
+    assert problems[1].startswith("Length mismatch")
+
+def test_no_hits(snapshot, data):
+    offset = counts_offset(data)
+    data = data[:offset] + bytes(12) + data[offset + 12:]
+    assert ReplayFile.decode(data).total_score
+
+    problems = verify(snapshot.score.filename_safe, data)
+    assert problems == ["No hits inside the header"]
@@ -0,0 +1,125 @@
+from outbox import Outbox, HEADER
+
+import pytest
+import os
+
+@pytest.fixture
+def path(tmp_path) -> str:
+    return str(tmp_path / "outbox" / "scores.journal")
+
+def create_outbox(path: str, deliver=None, max_size: int = 1024 ** 2) -> Outbox:
+    return Outbox(path, deliver or (lambda metadata, blob: None), max_size=max_size)
+
+def reopen(outbox: Outbox) -> Outbox:
+    """Simulate a restart of the process"""
+    outbox.file.close()
+    return create_outbox(outbox.path, outbox.deliver, outbox.max_size)
+
+def pending(outbox: Outbox) -> list:
+    return [outbox.read(location) for location in outbox.pending.values()]
+
+def test_restore(path):
+    outbox = create_outbox(path)
+    assert outbox.put({"id": 1}, b"replay-1")
+    assert outbox.put({"id": 2}, b"replay-2")
+
+    outbox = reopen(outbox)
+    assert pending(outbox) == [({"id": 1}, b"replay-1"), ({"id": 2}, b"replay-2")]
+
+    entry_id, entry = outbox.next()
+    assert entry == ({"id": 1}, b"replay-1")
+
+    # Entries written after a restart get new ids
+    outbox.put({"id": 3}, b"replay-3")
+    assert len(set(outbox.pending)) == 3
+
+def test_acknowledged_entries_are_not_restored(path):
+    outbox = create_outbox(path)
+    outbox.put({"id": 1}, b"replay-1")
+    outbox.put({"id": 2}, b"replay-2")
+
+    entry_id, _ = outbox.next()
+    outbox.ack(entry_id)
+    assert outbox.size == outbox.pending[entry_id + 1][1]
+
+    outbox = reopen(outbox)
+    assert pending(outbox) == [({"id": 2}, b"replay-2")]
+
+    # Acknowledged records were dropped from the journal
+    size = os.path.getsize(path)
+    assert size == HEADER.size + outbox.size
+
+def test_torn_tail(path):
+    outbox = create_outbox(path)
+    outbox.put({"id": 1}, b"replay-1")
+    outbox.put({"id": 2}, b"replay-2")
+    outbox.file.close()
+
+    # Process died while writing the second entry
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+
+    outbox = create_outbox(path)
+    assert pending(outbox) == [({"id": 1}, b"replay-1")]
+
+    outbox.put({"id": 3}, b"replay-3")
+    outbox = reopen(outbox)
+    assert pending(outbox) == [({"id": 1}, b"replay-1"), ({"id": 3}, b"replay-3")]
+
+def test_checksum_mismatch(path):
+    outbox = create_outbox(path)
+    outbox.put({"id": 1}, b"replay-1")
+    outbox.put({"id": 2}, b"replay-2")
+    offset, length = outbox.pending[1]
+    outbox.file.close()
+
+    with open(path, "r+b") as f:
+        f.seek(offset + length - 1)
+        f.write(b"X")
+
+    outbox = create_outbox(path)
+    assert pending(outbox) == [({"id": 1}, b"replay-1")]
+
+def test_compaction(path):
+    outbox = create_outbox(path, max_size=1024)
+    blob = bytes(300)
+
+    for index in range(10):
+        assert outbox.put({"id": index}, blob)
+        entry_id, _ = outbox.next()
+
+        if index < 9:
+            outbox.ack(entry_id)
+
+    # Journal was rewritten, once it got larger than twice the maximum size
+    assert os.path.getsize(path) < 2 * 1024
+    assert pending(outbox) == [({"id": 9}, blob)]
+
+    outbox = reopen(outbox)
+    assert pending(outbox) == [({"id": 9}, blob)]
+
+def test_full(path):
+    outbox = create_outbox(path, max_size=1024)
+
+    assert outbox.put({"id": 1}, bytes(600))
+    assert not outbox.put({"id": 2}, bytes(600))
+    assert len(outbox.pending) == 1
+
+def test_delivery_is_retried(path):
+    delivered = []
+
+    def deliver(metadata: dict, blob: bytes) -> None:
+        if not delivered:
+            delivered.append(None)
+            raise ConnectionError("redis is down")
+
+        delivered.append((metadata, blob))
+
+    outbox = create_outbox(path, deliver)
+    outbox.start()
+    outbox.put({"id": 1}, b"replay-1")
+    outbox.shutdown(timeout=5)
+
+    assert delivered == [None, ({"id": 1}, b"replay-1")]
+    assert not outbox.pending
+    assert not reopen(outbox).pending
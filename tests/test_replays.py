@@ -0,0 +1,68 @@
+from osu.bancho.streams import StreamIn
+from osu.objects import Player
+
+from benchmarks.synthetic import generate_play, replay_string
+from fakes import FakeGame, SnapshotCollector, setup
+from replays import ReplayManager
+
+import lzma
+import pytest
+
+def create_manager(memory_limit: int = 0, spill_directory=None) -> ReplayManager:
+    setup()
+    game = FakeGame()
+
+    player = Player(2, "peppy", game)
+    player.status.checksum = "da8aae79c8f3306b5d65ec951874a7fb"
+    game.bancho.spectating = player
+
+    manager = ReplayManager(
+        game,
+        SnapshotCollector(),
+        memory_limit=memory_limit,
+        spill_directory=spill_directory
+    )
+    manager.current_status = player.status
+    return manager
+
+def play(manager: ReplayManager, minutes: float = 1) -> str:
+    """Feed a synthetic play into the manager, returning its replay string"""
+    packets = generate_play(minutes, score_rate=1)
+
+    for action, frames, score_frame, extra in packets:
+        manager.handle_frames(frames, action, extra, score_frame)
+
+    # Frames of the completion are not part of the replay
+    return replay_string(packets[:-1])
+
+def compressed_stream(manager: ReplayManager) -> bytes:
+    snapshot, = manager.finalizer.snapshots
+    stream = StreamIn(snapshot.replay_compressed())
+    return stream.read(stream.s32())
+
+def test_compressor_is_created_with_first_frames():
+    manager = create_manager()
+    assert manager.replay.compressor is None
+
+    manager.replay.reset()
+    assert manager.replay.compressor is None
+
+    play(manager)
+    assert manager.replay.compressor is None
+
+@pytest.mark.parametrize("minutes", [0.5, 2])
+def test_incremental_stream_matches_compress(minutes):
+    manager = create_manager()
+    replay_string = play(manager, minutes)
+
+    expected = lzma.compress(replay_string.encode(), format=lzma.FORMAT_ALONE)
+    assert compressed_stream(manager) == expected
+
+def test_spilled_stream_matches_compress(tmp_path):
+    manager = create_manager(memory_limit=16 * 1024, spill_directory=str(tmp_path))
+    replay_string = play(manager)
+
+    assert manager.finalizer.snapshots[0].spill_file is not None
+
+    expected = lzma.compress(replay_string.encode(), format=lzma.FORMAT_ALONE)
+    assert compressed_stream(manager) == expected
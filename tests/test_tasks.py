@@ -0,0 +1,110 @@
+from osu.bancho.constants import ReplayAction
+from osu.objects import Player, Status
+
+from benchmarks.synthetic import generate_play
+from checkpoint import Checkpoints, encode_status
+from fakes import FakeExecutor, FakeGame, FakeRedis
+from events import EventQueue
+from leases import Leases
+from slots import Slot
+
+import session
+import pytest
+import json
+import time
+
+fakeredis = pytest.importorskip("fakeredis")
+
+# Api events are registered when importing the tasks
+session.api_queue = session.api_queue or EventQueue("api", FakeRedis())
+
+import tasks
+
+@pytest.fixture
+def slot() -> Slot:
+    session.redis = fakeredis.FakeRedis()
+    session.leases = Leases(session.redis)
+    session.checkpoints = Checkpoints(session.redis)
+    session.executor = FakeExecutor()
+    session.shards = None
+
+    return Slot(1, FakeGame(), worker_id="test")
+
+def save_checkpoint(slot: Slot, player_id: int, name: str) -> None:
+    session.checkpoints.save(
+        session.checkpoints.key(slot),
+        json.dumps({
+            "started": time.time() - 60,
+            "target": {"id": player_id, "name": name},
+            "status": encode_status(Status())
+        })
+    )
+
+def test_resume_waits_for_presence(slot):
+    save_checkpoint(slot, 2, "peppy")
+    slot.resume_pending = True
+
+    tasks.resume_target(slot)
+    assert not slot.spectating
+    assert slot.resume_pending
+    assert 2 in session.leases.claimed(slot.server)
+
+    slot.game.bancho.players.add(Player(2, "peppy", slot.game))
+
+    tasks.resume_target(slot)
+    assert slot.spectating.id == 2
+    assert not slot.resume_pending
+
+def test_resume_releases_offline_target(slot):
+    save_checkpoint(slot, 2, "peppy")
+    slot.resume_pending = True
+    slot.resume_timeout = 0
+
+    tasks.resume_target(slot)
+    assert not slot.spectating
+    assert not slot.resume_pending
+    assert slot.select_pending
+    assert session.leases.claimed(slot.server) == set()
+    assert session.checkpoints.load(slot) is None
+
+def test_resume_taken_over(slot):
+    save_checkpoint(slot, 2, "peppy")
+    session.leases.claim(slot.server, 2, "other")
+    slot.resume_pending = True
+
+    tasks.resume_target(slot)
+    assert not slot.spectating
+    assert not slot.resume_pending
+    assert slot.select_pending
+
+def add_player(slot: Slot, player_id: int, rank: int) -> Player:
+    player = Player(player_id, f"player{player_id}", slot.game)
+    player.rank = rank
+    player.status.checksum = f"checksum{player_id}"
+    slot.game.bancho.players.add(player)
+    slot.rankings.update(player)
+    return player
+
+def test_release_then_select(slot):
+    first = add_player(slot, 2, 1)
+    add_player(slot, 3, 2)
+
+    tasks.select_target(slot)
+    assert slot.spectating == first
+
+    slot.manager.handle_frames(generate_play(0.1)[0][1], ReplayAction.NewSong, 0, None)
+    assert slot.manager.replay.frames
+    assert slot.manager.current_status.checksum == "checksum2"
+
+    tasks.release_target(slot, first)
+    assert not slot.manager.replay.frames
+    assert not slot.manager.current_status.checksum
+
+    tasks.retarget(slot)
+    assert slot.spectating.id == 3
+    assert 2 not in session.leases.claimed(slot.server)
+
+    # Released targets are not selected again right away
+    tasks.release_target(slot, slot.spectating)
+    tasks.retarget(slot)
+    assert not slot.spectating